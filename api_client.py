@@ -0,0 +1,134 @@
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+API_URL = os.environ.get('SHOPPING_MALL_API_URL', 'http://localhost:8000').rstrip('/')
+API_TIMEOUT = float(os.environ.get('SHOPPING_MALL_API_TIMEOUT', '10'))
+API_CONNECTIONS = int(os.environ.get('SHOPPING_MALL_API_CONNECTIONS', '16'))
+CACHE_TTL = int(os.environ.get('SHOPPING_MALL_UI_CACHE_TTL', '30'))
+ETAG_ENTRIES = int(os.environ.get('SHOPPING_MALL_UI_ETAG_ENTRIES', '256'))
+
+class ETagStore:
+    def __init__(self, max_entries=ETAG_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, etag, body, headers):
+        with self._lock:
+            self._entries[key] = (etag, body, headers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+# Shared by every browser session of this Streamlit process, so the
+# keep-alive connections and remembered ETags survive script reruns.
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=API_CONNECTIONS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+@st.cache_resource
+def get_etag_store():
+    return ETagStore()
+
+def url(path):
+    return f'{API_URL}{path}'
+
+def auth_headers(token):
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def cached_get(path, params, token):
+    key = (path, params, token)
+    headers = auth_headers(token)
+    stored = get_etag_store().get(key)
+    if stored is not None:
+        headers["If-None-Match"] = stored[0]
+    response = get_http_session().get(url(path), params=list(params), headers=headers, timeout=API_TIMEOUT)
+    if response.status_code == 304 and stored is not None:
+        return stored[1], stored[2]
+    response.raise_for_status()
+    body, response_headers = response.json(), CaseInsensitiveDict(response.headers)
+    if 'ETag' in response.headers:
+        get_etag_store().put(key, response.headers['ETag'], body, response_headers)
+    return body, response_headers
+
+def get(path, params=None, token=None):
+    # Items rather than a dict so the cache key is hashable and list values
+    # (e.g. repeated group_by) keep their order.
+    items = []
+    for name, value in (params or {}).items():
+        for item in (value if isinstance(value, list) else [value]):
+            items.append((name, item))
+    return cached_get(path, tuple(items), token)
+
+def invalidate():
+    cached_get.clear()
+
+def mutate(method, path, token=None, headers=None, **kwargs):
+    response = get_http_session().request(method, url(path), headers={**auth_headers(token), **(headers or {})}, timeout=API_TIMEOUT, **kwargs)
+    if response.ok:
+        invalidate()
+    return response
+
+def login(username, password):
+    return get_http_session().get(url('/login'), params={"username": username, "password": password}, timeout=API_TIMEOUT)
+
+def logout(token):
+    return get_http_session().post(url('/logout'), headers=auth_headers(token), timeout=API_TIMEOUT)
+
+def register(username, password, full_name, address, payment_info):
+    return mutate('POST', '/register', params={"password": password}, json={
+        "username": username,
+        "role": "user",
+        "full_name": full_name,
+        "address": address,
+        "payment_info": payment_info
+    })
+
+def add_product(token, name, category, price, thumbnail_url):
+    return mutate('POST', '/add_product', token, params={
+        "name": name,
+        "category": category,
+        "price": price,
+        "thumbnail_url": thumbnail_url
+    })
+
+def delete_product(token, name):
+    return mutate('DELETE', f"/products/{quote(name, safe='')}", token)
+
+def add_purchase(token, purchase):
+    return mutate('POST', '/add_purchase', token, json=purchase)
+
+def checkout(token, items, buyer_address, idempotency_key):
+    return mutate('POST', '/checkout', token, headers={"Idempotency-Key": idempotency_key},
+                  json={"items": items, "buyer_address": buyer_address})
+
+def export_purchases(token, export_format):
+    response = get_http_session().get(url('/purchases/export'), params={"format": export_format}, headers=auth_headers(token), timeout=None)
+    response.raise_for_status()
+    return response.content
+
+def update_user_info(token, full_name, address, payment_info):
+    return mutate('POST', '/update_user_info', token, params={
+        "full_name": full_name,
+        "address": address,
+        "payment_info": payment_info
+    })
@@ -0,0 +1,44 @@
+# Compares loading products one POST /add_product call at a time with a
+# single NDJSON upload to POST /products/bulk:
+#   python -m benchmarks.bulk_import --rows 100000
+import argparse
+import json
+import os
+import time
+
+import httpx
+
+from benchmarks.common import login_headers, run_server, scratch_directory
+from benchmarks.datagen import generate
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--single-rows', type=int, default=1000)
+    args = parser.parse_args()
+
+    with scratch_directory() as workdir:
+        generate(os.path.join(workdir, 'shopping_mall.db'), users=1, products=0, purchases=0)
+        with run_server(workdir) as (base_url, _):
+            with httpx.Client(base_url=base_url, headers=login_headers(base_url), timeout=None) as client:
+                started = time.perf_counter()
+                for i in range(args.single_rows):
+                    client.post('/add_product', params={"name": f"single{i}", "category": "bench", "price": 1.0, "thumbnail_url": ""})
+                single_elapsed = time.perf_counter() - started
+
+                body = ''.join(json.dumps({"name": f"bulk{i}", "category": "bench", "price": 1.0}) + '\n' for i in range(args.rows))
+                started = time.perf_counter()
+                response = client.post('/products/bulk', content=body, headers={"content-type": "application/x-ndjson"}).json()
+                bulk_elapsed = time.perf_counter() - started
+
+    result = {
+        "single_rows_per_second": round(args.single_rows / single_elapsed),
+        "bulk_rows_per_second": round(response["inserted"] / bulk_elapsed),
+        "bulk_inserted": response["inserted"],
+        "bulk_failed": response["failed"],
+    }
+    result.update(vars(args))
+    print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
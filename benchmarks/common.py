@@ -0,0 +1,100 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from benchmarks.datagen import DATAGEN_PASSWORD
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(latencies, elapsed):
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0) * 1000, 2),
+    }
+
+@contextmanager
+def scratch_directory():
+    with tempfile.TemporaryDirectory(prefix='shopping_mall_bench_') as path:
+        yield path
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+@contextmanager
+def run_server(workdir, extra_env=None, extra_args=(), workers=None):
+    # With workers the app is started through `fastapi_app.py serve`, the
+    # supported multi-process entry point, instead of plain uvicorn.
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, SHOPPING_MALL_DB=os.path.join(workdir, 'shopping_mall.db'))
+    env.update(extra_env or {})
+    if workers is None:
+        command = [sys.executable, '-m', 'uvicorn', 'fastapi_app:app', '--port', str(port), '--log-level', 'warning', *extra_args]
+    else:
+        command = [sys.executable, os.path.join(REPO_ROOT, 'fastapi_app.py'), 'serve', '--port', str(port), '--workers', str(workers),
+                   '--log-level', 'warning', *extra_args]
+    process = subprocess.Popen(command, cwd=workdir, env=env)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                httpx.get(base_url + '/docs', timeout=1)
+                break
+            except httpx.HTTPError:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise RuntimeError('server did not start')
+                time.sleep(0.2)
+        yield base_url, process
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+def login_headers(base_url, username='user0', password=DATAGEN_PASSWORD):
+    # user0 is the generated administrator.
+    response = httpx.get(base_url + '/login', params={"username": username, "password": password}, timeout=60)
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+async def drive(base_url, requests, concurrency):
+    # `requests` is a list of (method, path, kwargs); each is sent once.
+    latencies = []
+    statuses = {}
+    pending = iter(requests)
+
+    async def worker(client):
+        for method, path, kwargs in pending:
+            started = time.perf_counter()
+            try:
+                status = (await client.request(method, path, **kwargs)).status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    result = summarize(latencies, elapsed)
+    result["statuses"] = statuses
+    return result
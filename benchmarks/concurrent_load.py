@@ -0,0 +1,36 @@
+# Measures p50/p99 latency of cheap requests while heavy listing requests run
+# on the same uvicorn worker. Run from any checkout to compare revisions:
+#   python -m benchmarks.concurrent_load --purchases 200000
+import argparse
+import asyncio
+import json
+import os
+
+from benchmarks.common import drive, login_headers, run_server, scratch_directory
+from benchmarks.datagen import generate
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--purchases', type=int, default=100000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--heavy-every', type=int, default=50)
+    args = parser.parse_args()
+
+    with scratch_directory() as workdir:
+        generate(os.path.join(workdir, 'shopping_mall.db'), users=100, products=args.products, purchases=args.purchases)
+        with run_server(workdir) as (base_url, _):
+            headers = login_headers(base_url)
+            requests = []
+            for i in range(args.requests):
+                if i % args.heavy_every == 0:
+                    requests.append(('GET', '/purchases', {"headers": headers}))
+                else:
+                    requests.append(('GET', '/me', {"headers": headers}))
+            result = asyncio.run(drive(base_url, requests, args.concurrency))
+    result.update(vars(args))
+    print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
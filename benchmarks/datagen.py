@@ -0,0 +1,130 @@
+# Generates a synthetic shopping mall database at any scale, migrated to the
+# current schema, with sales aggregates and the search index built:
+#   python -m benchmarks.datagen /tmp/mall.db --users 100000 --products 1000000 --purchases 10000000
+# Every user's password is DATAGEN_PASSWORD, stored as one bcrypt hash so
+# loading millions of users does not mean hashing millions of passwords.
+# user0 is the administrator. The same seed always produces the same data.
+import argparse
+import itertools
+import json
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from passlib.hash import bcrypt
+
+DATAGEN_PASSWORD = 'password'
+BATCH_SIZE = 50000
+CATEGORIES = 50
+PAYMENT_STATUSES = ['Completed'] * 8 + ['Pending', 'Refunded']
+START_TIME = datetime(2024, 1, 1)
+SPAN_SECONDS = 365 * 24 * 3600
+
+def make_vocabulary(rng, size):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return sorted({''.join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(size)})
+
+def popularity_weights(count, skew=1.1):
+    # Zipf-like: a few products and buyers account for most purchases, as in
+    # a real shop, which matters for index locality and cache hit rates.
+    return list(itertools.accumulate(1 / (rank ** skew) for rank in range(1, count + 1)))
+
+def batched(rows, size=BATCH_SIZE):
+    iterator = iter(rows)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+def generate_users(count, password_hash):
+    for i in range(count):
+        yield (f'user{i}', password_hash, 'admin' if i == 0 else 'user', f'User {i}', f'{i} Main St', f'card-{i:08d}')
+
+def generate_products(rng, count, words):
+    categories = [f'{word}s' for word in rng.sample(words, CATEGORIES)]
+    for i in range(count):
+        price = round(min(5000, rng.lognormvariate(3.5, 1.0)), 2)
+        yield (f"{' '.join(rng.sample(words, 3))} {i}", rng.choice(categories), price, '')
+
+def generate_purchases(rng, count, users, products, prices):
+    # Purchases are shuffled in ranks so the popular products are spread
+    # over the id range instead of all being the first ones inserted.
+    # User id 1 is the administrator and buys nothing.
+    product_ranks = list(range(1, products + 1))
+    buyer_ranks = list(range(2, users + 1))
+    rng.shuffle(product_ranks)
+    rng.shuffle(buyer_ranks)
+    product_weights = popularity_weights(products)
+    buyer_weights = popularity_weights(len(buyer_ranks))
+    step = SPAN_SECONDS / max(count, 1)
+    for i in range(count):
+        product_id = rng.choices(product_ranks, cum_weights=product_weights)[0]
+        buyer_id = rng.choices(buyer_ranks, cum_weights=buyer_weights)[0]
+        purchase_time = (START_TIME + timedelta(seconds=int(i * step))).isoformat()
+        quantity = 1 if rng.random() < 0.8 else rng.randint(2, 5)
+        yield (buyer_id, product_id, purchase_time, rng.choice(PAYMENT_STATUSES), f'{buyer_id} Main St', quantity, prices[product_id - 1])
+
+def generate(path, users=10000, products=10000, purchases=100000, seed=42, bcrypt_rounds=4, vocabulary=5000):
+    import fastapi_app
+
+    rng = random.Random(seed)
+    words = make_vocabulary(rng, vocabulary)
+    conn = sqlite3.connect(path)
+    fastapi_app.run_migrations(conn)
+    # Nothing needs to survive a crash mid-load, so skip the fsyncs.
+    conn.execute('PRAGMA synchronous = OFF')
+    timings = {}
+
+    started = time.perf_counter()
+    password_hash = bcrypt.using(rounds=bcrypt_rounds).hash(DATAGEN_PASSWORD)
+    for batch in batched(generate_users(users, password_hash)):
+        conn.executemany('INSERT INTO users (username, password, role, full_name, address, payment_info) VALUES (?, ?, ?, ?, ?, ?)', batch)
+    conn.commit()
+    timings["users_seconds"] = round(time.perf_counter() - started, 1)
+
+    started = time.perf_counter()
+    prices = []
+    for batch in batched(generate_products(rng, products, words)):
+        conn.executemany('INSERT INTO products (name, category, price, thumbnail_url) VALUES (?, ?, ?, ?)', batch)
+        prices.extend(row[2] for row in batch)
+    conn.commit()
+    timings["products_seconds"] = round(time.perf_counter() - started, 1)
+
+    started = time.perf_counter()
+    for batch in batched(generate_purchases(rng, purchases, users, products, prices)):
+        conn.executemany('''INSERT INTO purchases (buyer_id, product_id, purchase_time, payment_status, buyer_address, quantity, unit_price)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''', batch)
+        conn.commit()
+    timings["purchases_seconds"] = round(time.perf_counter() - started, 1)
+
+    started = time.perf_counter()
+    fastapi_app.rebuild_sales_aggregates(conn)
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.close()
+    timings["aggregates_seconds"] = round(time.perf_counter() - started, 1)
+    return {"path": path, "users": users, "products": products, "purchases": purchases, "seed": seed,
+            "bcrypt_rounds": bcrypt_rounds, "bytes": os.path.getsize(path), **timings}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--purchases', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--bcrypt-rounds', type=int, default=4)
+    parser.add_argument('--force', action='store_true', help='overwrite an existing database')
+    args = parser.parse_args()
+    if args.users < 2 or args.products < 1:
+        parser.error('need at least 2 users and 1 product')
+    if os.path.exists(args.path):
+        if not args.force:
+            parser.error(f'{args.path} exists, pass --force to overwrite it')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+    print(json.dumps(generate(args.path, args.users, args.products, args.purchases, args.seed, args.bcrypt_rounds), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# Streams the whole purchases table through GET /purchases/export and reports
+# throughput together with the server's peak resident memory:
+#   python -m benchmarks.export_purchases --purchases 2000000 --format csv
+import argparse
+import json
+import os
+import time
+
+import httpx
+
+from benchmarks.common import login_headers, run_server, scratch_directory
+from benchmarks.datagen import generate
+
+def peak_rss_mb(pid):
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return round(int(line.split()[1]) / 1024, 1)
+    return None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--purchases', type=int, default=2000000)
+    parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+    args = parser.parse_args()
+
+    with scratch_directory() as workdir:
+        generate(os.path.join(workdir, 'shopping_mall.db'), users=100, products=1000, purchases=args.purchases)
+        with run_server(workdir) as (base_url, process):
+            baseline_rss = peak_rss_mb(process.pid)
+            started = time.perf_counter()
+            received = lines = 0
+            with httpx.stream('GET', base_url + '/purchases/export', params={"format": args.format},
+                              headers=login_headers(base_url), timeout=None) as response:
+                for chunk in response.iter_bytes():
+                    received += len(chunk)
+                    lines += chunk.count(b'\n')
+            elapsed = time.perf_counter() - started
+            result = {
+                "rows": lines - (1 if args.format == 'csv' else 0),
+                "megabytes": round(received / 1e6, 1),
+                "seconds": round(elapsed, 2),
+                "rows_per_second": round(lines / elapsed),
+                "server_peak_rss_mb_before": baseline_rss,
+                "server_peak_rss_mb_after": peak_rss_mb(process.pid),
+            }
+    result.update(vars(args))
+    print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+# Drives the app with concurrent async clients over a weighted request mix
+# and prints per-scenario throughput and latency percentiles as JSON:
+#   python -m benchmarks.loadtest --mix mixed --requests 5000 --concurrency 32
+#   python -m benchmarks.loadtest --mode inprocess --mix browse --purchases 1000000
+#   python -m benchmarks.loadtest --db /tmp/mall.db --output after.json --baseline before.json
+# --mode uvicorn (the default) measures a real server over local TCP;
+# --mode inprocess calls the ASGI app directly, which isolates application
+# time from HTTP parsing. Without --db a database is generated with
+# benchmarks.datagen; with --db a copy of the given one is used, so it can
+# be generated once and reused across commits.
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import httpx
+
+from benchmarks.common import REPO_ROOT, run_server, scratch_directory, summarize
+from benchmarks.datagen import DATAGEN_PASSWORD, SPAN_SECONDS, START_TIME, generate
+
+SESSIONS = 50
+SETUP_CONCURRENCY = 4
+
+async def browse_products(client, context, rng):
+    return await client.get('/products', params={"cursor": rng.randint(0, context["products"]), "limit": 20})
+
+async def browse_category(client, context, rng):
+    return await client.get('/products', params={"category": rng.choice(context["categories"]), "limit": 20})
+
+async def search(client, context, rng):
+    return await client.get('/products/search', params={"q": rng.choice(context["words"])})
+
+async def autocomplete(client, context, rng):
+    return await client.get('/products/autocomplete', params={"q": rng.choice(context["words"])[:3]})
+
+async def login(client, context, rng):
+    return await client.get('/login', params={"username": f"user{rng.randint(1, context['users'] - 1)}", "password": DATAGEN_PASSWORD})
+
+async def me(client, context, rng):
+    return await client.get('/me', headers=rng.choice(context["sessions"]))
+
+async def checkout(client, context, rng):
+    items = [{"product_id": rng.randint(1, context["products"]), "quantity": rng.randint(1, 3)} for _ in range(rng.randint(1, 4))]
+    headers = {**rng.choice(context["sessions"]), "Idempotency-Key": uuid.uuid4().hex}
+    return await client.post('/checkout', json={"items": items, "buyer_address": "1 Main St"}, headers=headers)
+
+async def my_orders(client, context, rng):
+    return await client.get('/orders', params={"limit": 20}, headers=rng.choice(context["sessions"]))
+
+async def purchase_log(client, context, rng):
+    since = (START_TIME + timedelta(seconds=rng.randint(0, SPAN_SECONDS))).isoformat()
+    return await client.get('/purchases', params={"since": since, "limit": 100}, headers=context["admin"])
+
+async def buyer_purchases(client, context, rng):
+    return await client.get('/purchases', params={"buyer_id": rng.randint(2, context["users"]), "limit": 100}, headers=context["admin"])
+
+async def sales_report(client, context, rng):
+    return await client.get('/sales', params={"group_by": rng.choice(["day", "category", "payment_status"])}, headers=context["admin"])
+
+# Weights are relative within a mix.
+MIXES = {
+    "browse": {browse_products: 5, browse_category: 2, search: 3, autocomplete: 2},
+    "login": {login: 1},
+    "purchase": {checkout: 3, my_orders: 1, me: 1},
+    "admin": {purchase_log: 3, buyer_purchases: 3, sales_report: 1},
+    "mixed": {browse_products: 20, browse_category: 8, search: 12, autocomplete: 8, me: 10, my_orders: 4,
+              checkout: 8, login: 2, purchase_log: 2, buyer_purchases: 2, sales_report: 1},
+}
+
+def load_context(path):
+    conn = sqlite3.connect(path)
+    users, products, purchases = (conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+                                  for table in ('users', 'products', 'purchases'))
+    rng = random.Random(0)
+    sample = [rng.randint(1, products) for _ in range(200)]
+    names = conn.execute(f'SELECT name FROM products WHERE id IN ({", ".join("?" * len(sample))})', sample).fetchall()
+    categories = [row[0] for row in conn.execute('SELECT DISTINCT category FROM products LIMIT 100')]
+    conn.close()
+    words = sorted({word for (name,) in names for word in name.split() if not word.isdigit()})
+    return {"users": users, "products": products, "purchases": purchases, "words": words, "categories": categories}
+
+def stored_bcrypt_rounds(path):
+    conn = sqlite3.connect(path)
+    password_hash = conn.execute('SELECT password FROM users WHERE username = ?', ('user0',)).fetchone()[0]
+    conn.close()
+    return int(password_hash.split('$')[2])
+
+async def open_sessions(client, context, count):
+    limit = asyncio.Semaphore(SETUP_CONCURRENCY)
+
+    async def log_in(username):
+        async with limit:
+            response = await client.get('/login', params={"username": username, "password": DATAGEN_PASSWORD})
+            response.raise_for_status()
+            return {"Authorization": f"Bearer {response.json()['token']}"}
+
+    usernames = [f'user{i}' for i in random.Random(1).sample(range(1, context["users"]), min(count, context["users"] - 1))]
+    context["admin"] = await log_in('user0')
+    context["sessions"] = await asyncio.gather(*(log_in(username) for username in usernames))
+
+async def run_mix(client, context, mix, requests, concurrency, seed):
+    rng = random.Random(seed)
+    scenarios = list(MIXES[mix])
+    plan = rng.choices(scenarios, weights=[MIXES[mix][scenario] for scenario in scenarios], k=requests)
+    pending = iter(enumerate(plan))
+    latencies = {scenario.__name__: [] for scenario in scenarios}
+    statuses = {scenario.__name__: {} for scenario in scenarios}
+
+    async def worker():
+        for i, scenario in pending:
+            worker_rng = random.Random(seed * 1000003 + i)
+            started = time.perf_counter()
+            try:
+                status = (await scenario(client, context, worker_rng)).status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies[scenario.__name__].append(time.perf_counter() - started)
+            counts = statuses[scenario.__name__]
+            counts[status] = counts.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    overall = summarize([latency for samples in latencies.values() for latency in samples], elapsed)
+    overall["errors"] = sum(count for counts in statuses.values() for status, count in counts.items() if status != 200)
+    scenarios_result = {}
+    for name, samples in latencies.items():
+        if samples:
+            scenarios_result[name] = {**summarize(samples, elapsed), "statuses": statuses[name]}
+    return {"overall": overall, "scenarios": scenarios_result}
+
+async def drive_client(client, context, args):
+    await open_sessions(client, context, SESSIONS)
+    await run_mix(client, context, args.mix, min(args.warmup, args.requests), args.concurrency, args.seed + 1)
+    return await run_mix(client, context, args.mix, args.requests, args.concurrency, args.seed)
+
+async def run_inprocess(context, args):
+    import fastapi_app
+
+    transport = httpx.ASGITransport(app=fastapi_app.app)
+    async with fastapi_app.app.router.lifespan_context(fastapi_app.app):
+        async with httpx.AsyncClient(transport=transport, base_url='http://loadtest', timeout=60) as client:
+            return await drive_client(client, context, args)
+
+async def run_remote(base_url, context, args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        return await drive_client(client, context, args)
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(result, baseline):
+    # Positive throughput and negative latency changes are improvements.
+    def change(new, old):
+        return round((new / old - 1) * 100, 1) if old else None
+
+    deltas = {}
+    for name, current in [("overall", result["overall"]), *result["scenarios"].items()]:
+        previous = baseline["overall"] if name == "overall" else baseline["scenarios"].get(name)
+        if previous:
+            deltas[name] = {f"{key}_change_pct": change(current[key], previous[key]) for key in ("throughput_rps", "p50_ms", "p99_ms")}
+    return {"baseline_revision": baseline.get("revision"), "scenarios": deltas}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['uvicorn', 'inprocess'], default='uvicorn')
+    parser.add_argument('--mix', choices=sorted(MIXES), default='mixed')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='reuse a database made by benchmarks.datagen instead of generating one')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--purchases', type=int, default=100000)
+    parser.add_argument('--bcrypt-rounds', type=int, default=4, help='cost of the generated password hashes')
+    parser.add_argument('--uvicorn-args', default='', help='extra uvicorn arguments, e.g. "--workers 4"')
+    parser.add_argument('--output', help='also write the JSON result to this file')
+    parser.add_argument('--baseline', help='JSON result of an earlier run to compare against')
+    args = parser.parse_args()
+
+    original_directory = os.getcwd()
+    with scratch_directory() as workdir:
+        path = os.path.join(workdir, 'shopping_mall.db')
+        if args.db:
+            shutil.copyfile(args.db, path)
+        # Match the server's cost to the stored hashes so logins do not rehash.
+        rounds = stored_bcrypt_rounds(path) if args.db else args.bcrypt_rounds
+        env = {"SHOPPING_MALL_DB": path, "SHOPPING_MALL_BCRYPT_ROUNDS": str(rounds)}
+        if args.mode == 'inprocess':
+            # fastapi_app reads its settings on import, and datagen imports it.
+            os.environ.update(env)
+            os.chdir(workdir)
+        if args.db:
+            dataset = {"source": args.db}
+        else:
+            dataset = generate(path, args.users, args.products, args.purchases, args.seed, rounds)
+            del dataset["path"]
+        context = load_context(path)
+        dataset.update({key: context[key] for key in ("users", "products", "purchases")})
+        if args.mode == 'inprocess':
+            result = asyncio.run(run_inprocess(context, args))
+            os.chdir(original_directory)
+        else:
+            with run_server(workdir, extra_env=env, extra_args=args.uvicorn_args.split()) as (base_url, _):
+                result = asyncio.run(run_remote(base_url, context, args))
+
+    output = {"revision": git_revision(), "timestamp": datetime.now().isoformat(timespec='seconds'),
+              "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+              "dataset": dataset, **result}
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            output["comparison"] = compare(result, json.load(baseline))
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(text + '\n')
+    print(text)
+
+if __name__ == '__main__':
+    main()
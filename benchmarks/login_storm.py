@@ -0,0 +1,55 @@
+# Fires a burst of concurrent logins while a probe keeps requesting a cheap
+# endpoint, showing how much the bcrypt work delays unrelated requests and
+# how many logins are shed with 503:
+#   python -m benchmarks.login_storm --logins 500 --concurrency 64
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+from benchmarks.common import drive, run_server, scratch_directory, summarize
+from benchmarks.datagen import DATAGEN_PASSWORD, generate
+
+async def probe(base_url, stop):
+    latencies = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        while not stop.is_set():
+            started = time.perf_counter()
+            await client.get('/cache_stats')
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.01)
+    return latencies
+
+async def storm(base_url, requests, concurrency):
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(base_url, stop))
+    started = time.perf_counter()
+    logins = await drive(base_url, requests, concurrency)
+    stop.set()
+    probe_latencies = await probe_task
+    return logins, summarize(probe_latencies, time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--logins', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    env = {"SHOPPING_MALL_BCRYPT_ROUNDS": str(args.rounds), "SHOPPING_MALL_PASSWORD_WORKERS": str(args.workers)}
+    with scratch_directory() as workdir:
+        # Hashed at the server's cost, so no login in the storm rehashes.
+        generate(os.path.join(workdir, 'shopping_mall.db'), users=args.users, products=10, purchases=0, bcrypt_rounds=args.rounds)
+        with run_server(workdir, extra_env=env) as (base_url, _):
+            requests = [('GET', '/login', {"params": {"username": f"user{i % args.users}", "password": DATAGEN_PASSWORD}})
+                        for i in range(args.logins)]
+            logins, probe_result = asyncio.run(storm(base_url, requests, args.concurrency))
+    print(json.dumps({"login_requests": logins, "probe": probe_result, "config": vars(args)}, indent=2))
+
+if __name__ == '__main__':
+    main()
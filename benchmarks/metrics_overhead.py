@@ -0,0 +1,82 @@
+# Measures what the request middleware and statement timing cost. The
+# statement part times point lookups on a plain and an instrumented
+# connection in-process; the HTTP part runs the same request mix against a
+# server with SHOPPING_MALL_METRICS=0 and =1, alternating rounds:
+#   python -m benchmarks.metrics_overhead --statements 200000 --rounds 3
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import statistics
+import time
+
+from benchmarks.common import drive, login_headers, run_server, scratch_directory
+from benchmarks.datagen import generate
+
+def time_statements(path, factory, statements, products):
+    conn = sqlite3.connect(path, factory=factory)
+    cursor = conn.cursor()
+    ids = [random.randint(1, products) for _ in range(statements)]
+    started = time.perf_counter()
+    for product_id in ids:
+        cursor.execute('SELECT id, name, category, price FROM products WHERE id = ?', (product_id,))
+        cursor.fetchone()
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return elapsed / statements * 1e6
+
+def request_mix(headers, count, products, users):
+    requests = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            requests.append(('GET', '/me', {"headers": headers}))
+        elif kind == 1:
+            requests.append(('GET', f'/products/{random.randint(1, products)}/stock', {}))
+        elif kind == 2:
+            requests.append(('GET', '/purchases', {"params": {"buyer_id": random.randint(1, users - 1), "limit": 20}, "headers": headers}))
+        else:
+            requests.append(('GET', '/products', {"params": {"cursor": random.randint(0, products), "limit": 20}}))
+    return requests
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--purchases', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--statements', type=int, default=200000)
+    parser.add_argument('--requests', type=int, default=4000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    with scratch_directory() as workdir:
+        path = os.path.join(workdir, 'shopping_mall.db')
+        # Set before generate() first imports the app, so the module picks
+        # up the scratch database path.
+        os.environ['SHOPPING_MALL_DB'] = path
+        generate(path, users=args.users, products=args.products, purchases=args.purchases)
+        import fastapi_app
+        plain = time_statements(path, sqlite3.Connection, args.statements, args.products)
+        instrumented = time_statements(path, fastapi_app.InstrumentedConnection, args.statements, args.products)
+        statement_result = {"plain_us": round(plain, 2), "instrumented_us": round(instrumented, 2),
+                            "overhead_us": round(instrumented - plain, 2)}
+
+        http_result = {"off": [], "on": []}
+        for _ in range(args.rounds):
+            for mode, flag in (("off", "0"), ("on", "1")):
+                with run_server(workdir, extra_env={"SHOPPING_MALL_METRICS": flag}) as (base_url, _):
+                    requests = request_mix(login_headers(base_url), args.requests, args.products, args.users)
+                    asyncio.run(drive(base_url, requests[:200], args.concurrency))
+                    http_result[mode].append(asyncio.run(drive(base_url, requests, args.concurrency)))
+        summary = {}
+        for mode, runs in http_result.items():
+            summary[mode] = {key: statistics.median(run[key] for run in runs) for key in ("throughput_rps", "p50_ms", "p99_ms")}
+        summary["throughput_change_pct"] = round((summary["on"]["throughput_rps"] / summary["off"]["throughput_rps"] - 1) * 100, 2)
+
+    print(json.dumps({"statement": statement_result, "http": summary, "config": vars(args)}, indent=2))
+
+if __name__ == '__main__':
+    main()
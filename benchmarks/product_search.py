@@ -0,0 +1,57 @@
+# Compares the FTS5 index behind GET /products/search with a LIKE scan on a
+# large synthetic catalog, querying SQLite directly:
+#   python -m benchmarks.product_search --products 1000000
+import argparse
+import json
+import os
+import random
+import time
+
+from benchmarks.common import percentile, scratch_directory
+from benchmarks.datagen import make_vocabulary
+
+def timed(conn, query, params, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(query, params).fetchall()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--vocabulary', type=int, default=5000)
+    args = parser.parse_args()
+    rng = random.Random(7)
+    words = make_vocabulary(rng, args.vocabulary)
+
+    with scratch_directory() as workdir:
+        os.environ['SHOPPING_MALL_DB'] = os.path.join(workdir, 'shopping_mall.db')
+        import fastapi_app
+        fastapi_app.migrate_database()
+        conn = fastapi_app.create_connection()
+        started = time.perf_counter()
+        conn.executemany('INSERT INTO products (name, category, price, thumbnail_url) VALUES (?, ?, ?, ?)',
+                         ((' '.join(rng.sample(words, 3)) + f' {i}', rng.choice(words), 9.99, '') for i in range(args.products)))
+        conn.commit()
+        load_seconds = time.perf_counter() - started
+
+        fts, like = [], []
+        for _ in range(args.queries):
+            first, second = rng.sample(words, 2)
+            text = f'{first} {second[:3]}'
+            match = fastapi_app.build_match_query(text)
+            fts += timed(conn, '''SELECT products.id FROM products_fts JOIN products ON products.id = products_fts.rowid
+                                  WHERE products_fts MATCH ? ORDER BY bm25(products_fts, 10.0, 1.0) LIMIT 20''', (match,), 1)
+            like += timed(conn, 'SELECT id FROM products WHERE name LIKE ? AND name LIKE ? LIMIT 20',
+                          (f'%{first}%', f'%{second[:3]}%'), 1)
+        conn.close()
+
+    def stats(samples):
+        return {"p50_ms": round(percentile(samples, 50) * 1000, 2), "p99_ms": round(percentile(samples, 99) * 1000, 2)}
+    print(json.dumps({"load_seconds_with_triggers": round(load_seconds, 1), "fts5_ranked": stats(fts), "like_scan": stats(like), **vars(args)}, indent=2))
+
+if __name__ == '__main__':
+    main()
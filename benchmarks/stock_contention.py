@@ -0,0 +1,104 @@
+# Many buyers check out the same limited-stock product at once and the
+# result is checked for oversell: units sold must equal the stock taken and
+# never exceed what was there. With --reserve each buyer first reserves the
+# unit and then checks out against the reservation:
+#   python -m benchmarks.stock_contention --stock 500 --checkouts 2000 --concurrency 64
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+
+import httpx
+
+from benchmarks.common import login_headers, run_server, scratch_directory, summarize
+from benchmarks.datagen import DATAGEN_PASSWORD, generate
+
+PRODUCT_ID = 1
+# Kept low so the logins stay under the password hasher's queue limit.
+LOGIN_CONCURRENCY = 4
+
+async def login_buyers(base_url, buyers):
+    limit = asyncio.Semaphore(LOGIN_CONCURRENCY)
+
+    async def login(client, i):
+        async with limit:
+            response = await client.get('/login', params={"username": f"user{i}", "password": DATAGEN_PASSWORD})
+            response.raise_for_status()
+            return {"Authorization": f"Bearer {response.json()['token']}"}
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        return await asyncio.gather(*(login(client, i) for i in range(1, buyers + 1)))
+
+async def buy(client, headers, quantity, reserve):
+    order = {"items": [{"product_id": PRODUCT_ID, "quantity": quantity}], "buyer_address": "1 Main St"}
+    if reserve:
+        response = await client.post('/reservations', json={"items": order["items"]}, headers=headers)
+        if response.status_code != 200:
+            return response.status_code
+        order["reservation_id"] = response.json()["id"]
+    response = await client.post('/checkout', json=order, headers={**headers, "Idempotency-Key": uuid.uuid4().hex})
+    return response.status_code
+
+async def stampede(base_url, buyers, checkouts, quantity, concurrency, reserve):
+    latencies = []
+    statuses = {}
+    pending = iter(range(checkouts))
+
+    async def worker(client):
+        for i in pending:
+            started = time.perf_counter()
+            try:
+                status = await buy(client, buyers[i % len(buyers)], quantity, reserve)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    result = summarize(latencies, elapsed)
+    result["statuses"] = statuses
+    result["orders_per_second"] = round(statuses.get(200, 0) / elapsed, 1) if elapsed else 0.0
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--buyers', type=int, default=200)
+    parser.add_argument('--stock', type=int, default=500)
+    parser.add_argument('--checkouts', type=int, default=2000)
+    parser.add_argument('--quantity', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--reserve', action='store_true')
+    args = parser.parse_args()
+
+    with scratch_directory() as workdir:
+        generate(os.path.join(workdir, 'shopping_mall.db'), users=args.buyers + 1, products=10, purchases=0, bcrypt_rounds=4)
+        with run_server(workdir, extra_env={"SHOPPING_MALL_BCRYPT_ROUNDS": "4"}) as (base_url, _):
+            admin = login_headers(base_url)
+            httpx.put(f'{base_url}/products/{PRODUCT_ID}/stock', params={"stock": args.stock}, headers=admin).raise_for_status()
+            buyers = asyncio.run(login_buyers(base_url, args.buyers))
+            checkouts = asyncio.run(stampede(base_url, buyers, args.checkouts, args.quantity, args.concurrency, args.reserve))
+            final_stock = httpx.get(f'{base_url}/products/{PRODUCT_ID}/stock').json()
+            sales = httpx.get(f'{base_url}/sales', params={"group_by": "product", "product_id": PRODUCT_ID}, headers=admin).json()
+
+    sold_units = checkouts["statuses"].get(200, 0) * args.quantity
+    stock = {
+        "initial": args.stock,
+        "final": final_stock["stock"],
+        "reserved": final_stock["reserved"],
+        "sold_units": sold_units,
+        "recorded_sales_units": sum(row["purchases"] for row in sales),
+    }
+    stock["consistent"] = (0 <= stock["final"] and sold_units <= args.stock
+                           and sold_units == stock["recorded_sales_units"] == args.stock - stock["final"] - stock["reserved"])
+    print(json.dumps({"checkouts": checkouts, "stock": stock, "config": vars(args)}, indent=2))
+    if not stock["consistent"]:
+        raise SystemExit('stock accounting is inconsistent')
+
+if __name__ == '__main__':
+    main()
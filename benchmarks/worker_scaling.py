@@ -0,0 +1,51 @@
+# Runs the same request mix against `fastapi_app.py serve` with a growing
+# number of worker processes and reports throughput relative to one worker:
+#   python -m benchmarks.worker_scaling --workers 1 2 4 --mix browse --requests 5000
+# Every run gets its own copy of one generated database. Scaling is bounded
+# by the cores available (reported as "cpus") and, for write-heavy mixes,
+# by SQLite's single writer.
+import argparse
+import asyncio
+import json
+import os
+import shutil
+
+from benchmarks.common import run_server, scratch_directory
+from benchmarks.datagen import generate
+from benchmarks.loadtest import MIXES, git_revision, load_context, run_remote, stored_bcrypt_rounds
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--mix', choices=sorted(MIXES), default='browse')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='reuse a database made by benchmarks.datagen instead of generating one')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--purchases', type=int, default=100000)
+    args = parser.parse_args()
+
+    with scratch_directory() as workdir:
+        source = args.db or os.path.join(workdir, 'source.db')
+        if not args.db:
+            generate(source, args.users, args.products, args.purchases, args.seed)
+        env = {"SHOPPING_MALL_BCRYPT_ROUNDS": str(stored_bcrypt_rounds(source))}
+        runs = {}
+        for workers in args.workers:
+            rundir = os.path.join(workdir, f'workers{workers}')
+            os.mkdir(rundir)
+            shutil.copyfile(source, os.path.join(rundir, 'shopping_mall.db'))
+            context = load_context(source)
+            with run_server(rundir, extra_env=env, workers=workers) as (base_url, _):
+                runs[workers] = asyncio.run(run_remote(base_url, context, args))["overall"]
+
+    baseline = runs[args.workers[0]]["throughput_rps"]
+    for result in runs.values():
+        result["speedup"] = round(result["throughput_rps"] / baseline, 2) if baseline else None
+    print(json.dumps({"revision": git_revision(), "cpus": os.cpu_count(), "workers": runs, "config": vars(args)}, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,135 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Header, Path, Query, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError
 import sqlite3
-from datetime import datetime
+import argparse
+import asyncio
+import base64
+import bisect
+import csv
+import hashlib
+import hmac
+import io
+import multiprocessing
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+import urllib.request
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from datetime import datetime, timedelta
 from passlib.context import CryptContext
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
 app = FastAPI()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+DATABASE = os.environ.get('SHOPPING_MALL_DB', 'shopping_mall.db')
+DB_READERS = int(os.environ.get('SHOPPING_MALL_DB_READERS', '4'))
+DB_POOL_TIMEOUT = float(os.environ.get('SHOPPING_MALL_DB_POOL_TIMEOUT', '5'))
+DB_MAX_PENDING = int(os.environ.get('SHOPPING_MALL_DB_MAX_PENDING', '256'))
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EXPORT_BATCH_SIZE = 5000
+BULK_CHUNK_SIZE = 1000
+BULK_MAX_REPORTED_ERRORS = 1000
+MAX_ORDER_ITEMS = 100
+RESERVATION_TTL = int(os.environ.get('SHOPPING_MALL_RESERVATION_TTL', '900'))
+RESERVATION_SWEEP_INTERVAL = float(os.environ.get('SHOPPING_MALL_RESERVATION_SWEEP_INTERVAL', '30'))
+BCRYPT_ROUNDS = int(os.environ.get('SHOPPING_MALL_BCRYPT_ROUNDS', '12'))
+PASSWORD_WORKERS = int(os.environ.get('SHOPPING_MALL_PASSWORD_WORKERS', str(os.cpu_count() or 1)))
+PASSWORD_MAX_PENDING = int(os.environ.get('SHOPPING_MALL_PASSWORD_MAX_PENDING', str(PASSWORD_WORKERS * 8)))
+SECRET_KEY = os.environ.get('SHOPPING_MALL_SECRET_KEY') or secrets.token_hex(32)
+# Set by `serve --workers N`: state that several worker processes must agree
+# on (sessions, the catalog version behind product ETags) lives in the
+# database instead of in each process.
+SHARED_STATE = os.environ.get('SHOPPING_MALL_SHARED_STATE', '0') == '1'
+SESSION_BACKEND = os.environ.get('SHOPPING_MALL_SESSION_BACKEND', 'sqlite' if SHARED_STATE else 'memory')
+SESSION_TTL = int(os.environ.get('SHOPPING_MALL_SESSION_TTL', '3600'))
+SESSION_MAX_ENTRIES = int(os.environ.get('SHOPPING_MALL_SESSION_MAX_ENTRIES', '10000'))
+SESSION_PURGE_INTERVAL = 60
+THUMBNAIL_DIR = os.environ.get('SHOPPING_MALL_THUMBNAIL_DIR', 'thumbnails')
+THUMBNAIL_QUOTA_BYTES = int(os.environ.get('SHOPPING_MALL_THUMBNAIL_QUOTA_BYTES', str(256 * 1024 * 1024)))
+THUMBNAIL_MAX_BYTES = int(os.environ.get('SHOPPING_MALL_THUMBNAIL_MAX_BYTES', str(5 * 1024 * 1024)))
+THUMBNAIL_FETCH_WORKERS = int(os.environ.get('SHOPPING_MALL_THUMBNAIL_FETCH_WORKERS', '4'))
+THUMBNAIL_FETCH_TIMEOUT = float(os.environ.get('SHOPPING_MALL_THUMBNAIL_FETCH_TIMEOUT', '10'))
+THUMBNAIL_WIDTHS = (200, 400)
+PRODUCT_CACHE_ENTRIES = int(os.environ.get('SHOPPING_MALL_PRODUCT_CACHE_ENTRIES', '256'))
+METRICS_ENABLED = os.environ.get('SHOPPING_MALL_METRICS', '1') != '0'
+COMPRESSION_MIN_BYTES = int(os.environ.get('SHOPPING_MALL_COMPRESSION_MIN_BYTES', '1000'))
+GZIP_LEVEL = int(os.environ.get('SHOPPING_MALL_GZIP_LEVEL', '5'))
+SLOW_QUERY_SECONDS = float(os.environ.get('SHOPPING_MALL_SLOW_QUERY_MS', '100')) / 1000
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 class Purchase(BaseModel):
+    id: Optional[int] = None
     buyer_id: int
     product_id: int
     purchase_time: str
     payment_status: str
     buyer_address: str
+    quantity: int = Field(1, ge=1)
+    unit_price: Optional[float] = None
+
+class PurchaseLine(Purchase):
+    # order_id is set, and id is not, for the lines of /checkout orders.
+    order_id: Optional[int] = None
+
+class UserPurchase(BaseModel):
+    id: Optional[int] = None
+    order_id: Optional[int] = None
+    product_id: int
+    product_name: Optional[str] = None
+    price: Optional[float] = None
+    purchase_time: str
+    payment_status: str
+    quantity: int
+    unit_price: Optional[float] = None
+
+class OrderItem(BaseModel):
+    product_id: int
+    quantity: int = Field(1, ge=1)
+
+class Order(BaseModel):
+    items: List[OrderItem] = Field(min_length=1, max_length=MAX_ORDER_ITEMS)
+    payment_status: str = "Completed"
+    buyer_address: str
+    reservation_id: Optional[int] = None
+
+class Reservation(BaseModel):
+    items: List[OrderItem] = Field(min_length=1, max_length=MAX_ORDER_ITEMS)
 
 class User(BaseModel):
     id: Optional[int] = None
@@ -30,14 +145,564 @@ class Product(BaseModel):
     category: str
     price: float
     thumbnail_url: Optional[str] = None
+    stock: Optional[int] = Field(None, ge=0)
+
+class Histogram:
+    # Prometheus-style histogram keyed by a tuple of label values. Bucket
+    # counts are kept per bucket and only made cumulative when rendered.
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in sorted(self._series.items())]
+        for labels, counts, total in series:
+            label_text = format_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text}{"," if label_text else ""}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f'{self.name}{{{format_labels(self.label_names, labels)}}} {value}' for labels, value in values)
+        return lines
+
+def format_labels(names, values):
+    escaped = [str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values]
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+request_duration = Histogram('shopping_mall_request_duration_seconds', 'Time from request start to the last response byte.',
+                             ('method', 'route'), REQUEST_BUCKETS)
+request_count = Counter('shopping_mall_requests_total', 'Requests by route and status code.', ('method', 'route', 'status'))
+query_duration = Histogram('shopping_mall_db_query_duration_seconds', 'Time to execute one SQL statement, up to its first row.',
+                           ('statement',), QUERY_BUCKETS)
+slow_query_count = Counter('shopping_mall_db_slow_queries_total', 'Statements slower than SHOPPING_MALL_SLOW_QUERY_MS.', ('statement',))
+db_call_duration = Histogram('shopping_mall_db_call_duration_seconds', 'Time spent in one database helper, including fetching rows.',
+                             ('helper',), QUERY_BUCKETS)
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    # Literals and variable-length IN lists collapse so that one label covers
+    # every execution of the same statement. The text is kept whole: the
+    # queries built from optional filters differ only in their WHERE clauses.
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?)', sql)
+    return ' '.join(sql.split())
+
+def observe_query(sql, started):
+    elapsed = time.perf_counter() - started
+    statement = normalize_sql(sql)
+    query_duration.observe((statement,), elapsed)
+    if elapsed >= SLOW_QUERY_SECONDS:
+        slow_query_count.inc((statement,))
+        logging.getLogger(__name__).warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observe_query(sql, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            observe_query(sql, started)
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+class MetricsMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware, which would add a task and a
+    # body-copying stream to every request. Routes are labelled by their path
+    # template so /orders/1 and /orders/2 share a series.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else "unmatched")
+            request_duration.observe(labels, time.perf_counter() - started)
+            request_count.inc((*labels, status))
+
+# Registered before the metrics middleware so request timings include the
+# compression. brotli-asgi serves br to clients that accept it and gzip to
+# the rest; images are left alone either way.
+if COMPRESSION_MIN_BYTES > 0:
+    if BrotliMiddleware is not None:
+        app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_BYTES, gzip_fallback=True)
+    else:
+        app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_BYTES, compresslevel=GZIP_LEVEL)
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+def helper_name(fn, args):
+    # paginate(conn, get_all_purchases, ...) is reported as paginate:get_all_purchases.
+    name = getattr(fn, '__name__', 'unknown')
+    if args and callable(args[0]):
+        name += ':' + getattr(args[0], '__name__', 'unknown')
+    return name
+
+def render_gauges(prefix, stats):
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, (int, float)):
+            lines.append(f'# TYPE {prefix}_{key} gauge')
+            lines.append(f'{prefix}_{key} {int(value) if isinstance(value, bool) else value}')
+    return lines
 
 def create_connection():
-    return sqlite3.connect('shopping_mall.db', check_same_thread=False)
+    conn = sqlite3.connect(DATABASE, check_same_thread=False, timeout=DB_POOL_TIMEOUT,
+                           factory=InstrumentedConnection if METRICS_ENABLED else sqlite3.Connection)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA cache_size = -16000')
+    conn.execute('PRAGMA mmap_size = 268435456')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
 
-def create_tables():
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
+class ConnectionPool:
+    # Readers share a bounded set of connections; all writes go through one
+    # connection guarded by a lock so WAL never sees competing writers.
+    # read()/write() run the blocking sqlite3 work on dedicated threads sized
+    # to the connections, so the event loop only ever awaits a future.
+    def __init__(self, readers=DB_READERS, timeout=DB_POOL_TIMEOUT, max_pending=DB_MAX_PENDING):
+        self.size = readers
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.pending = 0
+        self._read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-read')
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-write')
+        self._readers = queue.LifoQueue(maxsize=readers)
+        for _ in range(readers):
+            self._readers.put(create_connection())
+        self._writer = create_connection()
+        self._writer_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {"reader_acquired": 0, "reader_wait_seconds": 0.0, "reader_max_wait_seconds": 0.0,
+                      "writer_acquired": 0, "writer_wait_seconds": 0.0, "writer_max_wait_seconds": 0.0,
+                      "timeouts": 0, "rejected": 0}
+
+    def _record_wait(self, kind, waited):
+        with self._stats_lock:
+            self.stats[f"{kind}_acquired"] += 1
+            self.stats[f"{kind}_wait_seconds"] += waited
+            self.stats[f"{kind}_max_wait_seconds"] = max(self.stats[f"{kind}_max_wait_seconds"], waited)
+
+    def _timed_out(self):
+        with self._stats_lock:
+            self.stats["timeouts"] += 1
+        raise HTTPException(status_code=503, detail="Database is busy, try again later")
+
+    def _remaining(self, queued):
+        # Executor threads match the connections, so a call mostly waits in
+        # the executor queue rather than on the pool. Both count as waiting
+        # and share one timeout, measured from when the call was submitted.
+        remaining = self.timeout - (time.perf_counter() - queued)
+        if remaining <= 0:
+            self._timed_out()
+        return remaining
+
+    @contextmanager
+    def reader(self, queued=None):
+        queued = time.perf_counter() if queued is None else queued
+        try:
+            conn = self._readers.get(timeout=self._remaining(queued))
+        except queue.Empty:
+            self._timed_out()
+        self._record_wait("reader", time.perf_counter() - queued)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self, queued=None):
+        queued = time.perf_counter() if queued is None else queued
+        if not self._writer_lock.acquire(timeout=self._remaining(queued)):
+            self._timed_out()
+        self._record_wait("writer", time.perf_counter() - queued)
+        try:
+            yield self._writer
+        finally:
+            if self._writer.in_transaction:
+                self._writer.rollback()
+            self._writer_lock.release()
+
+    def _call(self, acquire, queued, fn, args, kwargs):
+        with acquire(queued) as conn:
+            if not METRICS_ENABLED:
+                return fn(conn, *args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(conn, *args, **kwargs)
+            finally:
+                db_call_duration.observe((helper_name(fn, args),), time.perf_counter() - started)
+
+    async def _submit(self, executor, acquire, fn, args, kwargs):
+        if self.pending >= self.max_pending:
+            with self._stats_lock:
+                self.stats["rejected"] += 1
+            raise HTTPException(status_code=503, detail="Database is busy, try again later")
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, self._call, acquire, time.perf_counter(), fn, args, kwargs)
+        finally:
+            self.pending -= 1
+
+    async def read(self, fn, *args, **kwargs):
+        return await self._submit(self._read_executor, self.reader, fn, args, kwargs)
+
+    async def write(self, fn, *args, **kwargs):
+        return await self._submit(self._write_executor, self.writer, fn, args, kwargs)
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["pending"] = self.pending
+        stats["readers_total"] = self.size
+        stats["readers_idle"] = self._readers.qsize()
+        stats["writer_busy"] = self._writer_lock.locked()
+        return stats
+
+    def close(self):
+        self._read_executor.shutdown(wait=True)
+        self._write_executor.shutdown(wait=True)
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+        self._writer.close()
+
+db_pool = None
+
+def get_db_pool():
+    if db_pool is None:
+        raise HTTPException(status_code=503, detail="Database pool is not ready")
+    return db_pool
+
+# Sales are aggregated per (hour, product, payment status) in the same
+# transaction as the purchase or order insert. A missing unit price falls
+# back to the product's current catalog price.
+RECORD_SALE_QUERY = '''
+    INSERT INTO sales_hourly (hour, product_id, payment_status, purchases, revenue)
+    VALUES (?, ?, ?, ?, ? * COALESCE(?, (SELECT price FROM products WHERE id = ?), 0))
+    ON CONFLICT (hour, product_id, payment_status)
+    DO UPDATE SET purchases = purchases + excluded.purchases, revenue = revenue + excluded.revenue
+'''
+
+REBUILD_SALES_QUERY = '''
+    INSERT INTO sales_hourly (hour, product_id, payment_status, purchases, revenue)
+    SELECT hour, product_id, payment_status, SUM(quantity), COALESCE(SUM(quantity * unit_price), 0)
+    FROM (
+        SELECT substr(purchase_time, 1, 13) AS hour, product_id, payment_status, quantity, unit_price FROM purchases
+        UNION ALL
+        SELECT substr(orders.created_at, 1, 13), order_items.product_id, orders.payment_status, order_items.quantity, order_items.unit_price
+        FROM order_items JOIN orders ON orders.id = order_items.order_id
+    )
+    GROUP BY 1, 2, 3
+'''
+
+class ProductCache:
+    # Serialized product listings keyed by query. Every catalog write bumps
+    # the version and drops all entries, so an ETag built from the version is
+    # valid for as long as the version is current. A shared cache takes the
+    # version from the catalog_version row that triggers bump on every
+    # product change, so all workers see each other's writes and hand out
+    # the same ETags; a local one counts its own writes and adds a
+    # per-process generation because its count restarts at zero.
+    def __init__(self, max_entries=PRODUCT_CACHE_ENTRIES, shared=SHARED_STATE):
+        self.max_entries = max_entries
+        self.shared = shared
+        self.generation = 'db' if shared else uuid.uuid4().hex[:8]
+        self.version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0}
+
+    def etag(self, key, version=None):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+        return f'"{self.generation}-{self.version if version is None else version}-{digest}"'
+
+    def count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    async def current_version(self, pool):
+        if not self.shared:
+            return self.version
+        version = await pool.read(get_catalog_version)
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._entries.clear()
+        return version
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+    def put(self, key, version, entry):
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            if not self.shared:
+                self.version += 1
+            self._entries.clear()
+            self.stats["invalidations"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["version"] = self.version
+        return stats
+
+product_cache = ProductCache()
+
+IMAGE_SIGNATURES = [(b'\x89PNG', 'image/png', 'PNG'), (b'\xff\xd8\xff', 'image/jpeg', 'JPEG'),
+                    (b'GIF8', 'image/gif', 'GIF'), (b'RIFF', 'image/webp', 'WEBP')]
+
+def sniff_image(data):
+    for signature, media_type, image_format in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return media_type, image_format
+    return None, None
+
+class ThumbnailStore:
+    # Content-addressed image files named by the SHA-256 of the original,
+    # plus resized variants named <hash>-<width>. File mtimes track last use
+    # and the least recently used files are evicted beyond the disk quota.
+    def __init__(self, directory=THUMBNAIL_DIR, quota_bytes=THUMBNAIL_QUOTA_BYTES, workers=THUMBNAIL_FETCH_WORKERS):
+        self.directory = directory
+        self.quota_bytes = quota_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        self._in_flight = {}
+        self._quota_lock = threading.Lock()
+        self.stats = {"fetched": 0, "failed": 0, "evicted": 0}
+
+    def path(self, digest, width=None):
+        return os.path.join(self.directory, digest if width is None else f'{digest}-{width}')
+
+    def download(self, url):
+        if url.startswith('data:'):
+            header, _, payload = url.partition(',')
+            return base64.b64decode(payload) if header.endswith(';base64') else urllib.request.unquote_to_bytes(payload)
+        if not url.startswith(('http://', 'https://')):
+            raise ValueError(f"Unsupported thumbnail URL scheme: {url[:16]}")
+        with urllib.request.urlopen(url, timeout=THUMBNAIL_FETCH_TIMEOUT) as response:
+            data = response.read(THUMBNAIL_MAX_BYTES + 1)
+        if len(data) > THUMBNAIL_MAX_BYTES:
+            raise ValueError("Thumbnail is larger than the configured limit")
+        return data
+
+    def write(self, path, data):
+        partial = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(partial, 'wb') as output:
+            output.write(data)
+        os.replace(partial, path)
+
+    def resize(self, data, image_format, width):
+        if Image is None:
+            return data
+        with Image.open(io.BytesIO(data)) as image:
+            if image.width <= width:
+                return data
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height))
+            if image_format == 'JPEG' and resized.mode not in ('RGB', 'L'):
+                resized = resized.convert('RGB')
+            output = io.BytesIO()
+            resized.save(output, format=image_format)
+            return output.getvalue()
+
+    def ingest(self, url):
+        data = self.download(url)
+        media_type, image_format = sniff_image(data)
+        if media_type is None:
+            raise ValueError("Thumbnail is not a PNG, JPEG, GIF or WEBP image")
+        digest = hashlib.sha256(data).hexdigest()
+        # The quota evicts files one at a time, so an original can outlive
+        # its variants; anything missing is written again.
+        missing = [width for width in (None, *THUMBNAIL_WIDTHS) if not os.path.exists(self.path(digest, width))]
+        for width in missing:
+            self.write(self.path(digest, width), data if width is None else self.resize(data, image_format, width))
+        if missing:
+            self.enforce_quota()
+        return digest
+
+    def restore_variant(self, digest, width):
+        # Rebuilds an evicted variant from the original without downloading.
+        try:
+            with open(self.path(digest), 'rb') as image:
+                data = image.read()
+        except FileNotFoundError:
+            return False
+        _, image_format = sniff_image(data)
+        self.write(self.path(digest, width), self.resize(data, image_format, width))
+        self.enforce_quota()
+        return True
+
+    async def restore(self, digest, width):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.restore_variant, digest, width)
+
+    async def fetch(self, url):
+        # Concurrent requests for the same URL share one download.
+        if url not in self._in_flight:
+            loop = asyncio.get_running_loop()
+            self._in_flight[url] = loop.run_in_executor(self._executor, self.ingest, url)
+        future = self._in_flight[url]
+        try:
+            digest = await asyncio.shield(future)
+            self.stats["fetched"] += 1
+            return digest
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            if future.done():
+                self._in_flight.pop(url, None)
+
+    def open(self, digest, width=None):
+        path = self.path(digest, width)
+        try:
+            os.utime(path)
+            with open(path, 'rb') as image:
+                media_type, _ = sniff_image(image.read(16))
+        except FileNotFoundError:
+            return None, None
+        return path, media_type
+
+    def enforce_quota(self):
+        with self._quota_lock:
+            files = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.quota_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.stats["evicted"] += 1
+
+    def snapshot(self):
+        return {**self.stats, "in_flight": len(self._in_flight), "quota_bytes": self.quota_bytes}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+thumbnail_store = None
+reservation_sweeper = None
+
+def get_thumbnail_store():
+    if thumbnail_store is None:
+        raise HTTPException(status_code=503, detail="Thumbnail store is not ready")
+    return thumbnail_store
+
+def etag_matches(request, etag):
+    header = request.headers.get('if-none-match')
+    if header is None:
+        return False
+    return header.strip() == '*' or etag in [tag.strip() for tag in header.split(',')]
+
+def dump_json(content):
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(',', ':')).encode()
+
+class FastJSONResponse(Response):
+    # List endpoints return this directly, which skips FastAPI's per-row
+    # response_model validation; their response_model is only documentation.
+    media_type = "application/json"
+
+    def render(self, content):
+        return dump_json(content)
+
+MIGRATIONS = [
+    (1, 'create users, products and purchases tables', [
+        '''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT UNIQUE,
@@ -47,8 +712,8 @@ def create_tables():
             address TEXT,
             payment_info TEXT
         )
-    ''')
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS products (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT UNIQUE,
@@ -56,8 +721,8 @@ def create_tables():
             price REAL,
             thumbnail_url TEXT
         )
-    ''')
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS purchases (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             buyer_id INTEGER,
@@ -68,9 +733,241 @@ def create_tables():
             FOREIGN KEY(buyer_id) REFERENCES users(id),
             FOREIGN KEY(product_id) REFERENCES products(id)
         )
-    ''')
-    conn.commit()
-    conn.close()
+        ''',
+    ]),
+    (2, 'index purchase lookups and product categories', [
+        'CREATE INDEX IF NOT EXISTS idx_purchases_buyer_id ON purchases (buyer_id)',
+        'CREATE INDEX IF NOT EXISTS idx_purchases_product_id ON purchases (product_id)',
+        'CREATE INDEX IF NOT EXISTS idx_purchases_purchase_time ON purchases (purchase_time)',
+        'CREATE INDEX IF NOT EXISTS idx_products_category ON products (category)',
+    ]),
+    (3, 'enforce unique product names', [
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_products_name ON products (name)',
+    ]),
+    (4, 'add hourly sales aggregates', [
+        '''
+        CREATE TABLE IF NOT EXISTS sales_hourly (
+            hour TEXT,
+            product_id INTEGER,
+            payment_status TEXT,
+            purchases INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, product_id, payment_status)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT INTO sales_hourly (hour, product_id, payment_status, purchases, revenue)
+        SELECT substr(purchases.purchase_time, 1, 13), purchases.product_id, purchases.payment_status,
+               COUNT(*), COALESCE(SUM(products.price), 0)
+        FROM purchases LEFT JOIN products ON products.id = purchases.product_id
+        GROUP BY 1, 2, 3
+        ''',
+    ]),
+    (5, 'add full-text product search', [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, category, content='products', content_rowid='id', prefix='2 3'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name, category) VALUES (new.id, new.name, new.category);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, category) VALUES ('delete', old.id, old.name, old.category);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, category ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, category) VALUES ('delete', old.id, old.name, old.category);
+            INSERT INTO products_fts (rowid, name, category) VALUES (new.id, new.name, new.category);
+        END
+        ''',
+        "INSERT INTO products_fts (products_fts) VALUES ('rebuild')",
+    ]),
+    (6, 'record locally cached product thumbnails', [
+        'ALTER TABLE products ADD COLUMN thumbnail_hash TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_products_thumbnail_hash ON products (thumbnail_hash)',
+    ]),
+    (7, 'add orders and record quantity and price at time of sale', [
+        'ALTER TABLE purchases ADD COLUMN quantity INTEGER NOT NULL DEFAULT 1',
+        'ALTER TABLE purchases ADD COLUMN unit_price REAL',
+        'UPDATE purchases SET unit_price = (SELECT price FROM products WHERE products.id = purchases.product_id)',
+        '''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            buyer_id INTEGER NOT NULL,
+            idempotency_key TEXT,
+            request_hash TEXT,
+            created_at TEXT,
+            payment_status TEXT,
+            buyer_address TEXT,
+            total REAL,
+            FOREIGN KEY(buyer_id) REFERENCES users(id)
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_idempotency_key ON orders (buyer_id, idempotency_key)',
+        '''
+        CREATE TABLE IF NOT EXISTS order_items (
+            order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            unit_price REAL NOT NULL,
+            PRIMARY KEY (order_id, product_id),
+            FOREIGN KEY(order_id) REFERENCES orders(id),
+            FOREIGN KEY(product_id) REFERENCES products(id)
+        ) WITHOUT ROWID
+        ''',
+        'DELETE FROM sales_hourly',
+        REBUILD_SALES_QUERY,
+    ]),
+    (8, 'track product stock and reservations', [
+        # NULL stock means the product is not stock-tracked and never sells out.
+        'ALTER TABLE products ADD COLUMN stock INTEGER CHECK (stock >= 0)',
+        '''
+        CREATE TABLE IF NOT EXISTS reservations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            buyer_id INTEGER NOT NULL,
+            created_at TEXT,
+            expires_at TEXT,
+            FOREIGN KEY(buyer_id) REFERENCES users(id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_reservations_expires_at ON reservations (expires_at)',
+        '''
+        CREATE TABLE IF NOT EXISTS reservation_items (
+            reservation_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (reservation_id, product_id),
+            FOREIGN KEY(reservation_id) REFERENCES reservations(id),
+            FOREIGN KEY(product_id) REFERENCES products(id)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (9, 'share sessions and the catalog version between worker processes', [
+        '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            user TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)',
+        'CREATE TABLE IF NOT EXISTS catalog_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)',
+        'INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)',
+        # Stock is left out so checkouts do not invalidate cached listings.
+        '''
+        CREATE TRIGGER IF NOT EXISTS products_catalog_insert AFTER INSERT ON products
+        BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS products_catalog_update AFTER UPDATE OF name, category, price, thumbnail_url, thumbnail_hash ON products
+        BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS products_catalog_delete AFTER DELETE ON products
+        BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END
+        ''',
+    ]),
+    (10, 'cover per-buyer purchase history', [
+        # Newest-first pages for one buyer are a backwards range scan of this
+        # index alone; idx_purchases_buyer_id stays for the admin log, which
+        # filters by buyer but pages by id.
+        '''
+        CREATE INDEX IF NOT EXISTS idx_purchases_buyer_history
+        ON purchases (buyer_id, purchase_time, id, product_id, quantity, unit_price, payment_status)
+        ''',
+    ]),
+    (11, 'list checkout orders in the purchase log', [
+        'CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at)',
+    ]),
+    (12, 'cover per-buyer order history', [
+        'CREATE INDEX IF NOT EXISTS idx_orders_buyer_history ON orders (buyer_id, created_at, id, payment_status)',
+    ]),
+    (13, 'serve product and buyer listings in key order', [
+        # Product-filtered purchase log pages are read in time order; the
+        # new index replaces the product_id one, which is its prefix.
+        'CREATE INDEX IF NOT EXISTS idx_purchases_product_time ON purchases (product_id, purchase_time)',
+        'DROP INDEX IF EXISTS idx_purchases_product_id',
+        # Counts and lists one product's order lines without reading them all.
+        'CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items (product_id)',
+        # GET /orders pages one buyer's orders by id.
+        'CREATE INDEX IF NOT EXISTS idx_orders_buyer_id ON orders (buyer_id)',
+    ]),
+]
+
+def get_schema_version(conn):
+    cursor = conn.cursor()
+    cursor.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, description TEXT, applied_at TEXT)')
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    return cursor.fetchone()[0]
+
+def run_migrations(conn):
+    # Each migration runs in its own transaction together with its
+    # schema_version row, so a failed step leaves the database at the
+    # previous version and is retried on the next startup.
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version <= get_schema_version(conn):
+            continue
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute('INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                           (version, description, datetime.now().isoformat()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+@contextmanager
+def file_lock(path):
+    with open(path, 'a+b') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def database_lock():
+    return file_lock(DATABASE + '.lock')
+
+def migrate_database():
+    with database_lock():
+        conn = create_connection()
+        try:
+            return run_migrations(conn)
+        finally:
+            conn.close()
+
+def initialize_database():
+    # Every worker runs this on startup. The first one to take the lock
+    # migrates and seeds the administrator; the others wait for it and then
+    # find nothing left to do.
+    with database_lock():
+        conn = create_connection()
+        try:
+            applied = run_migrations(conn)
+            if not admin_exists(conn):
+                create_admin(conn, hash_password('admin'))
+            return applied
+        finally:
+            conn.close()
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -78,6 +975,188 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, stored_password: Optional[str]):
+    # Returns (valid, new_hash). new_hash is set when the stored value should
+    # be replaced: a legacy plaintext password or a bcrypt cost that differs
+    # from BCRYPT_ROUNDS.
+    if not stored_password:
+        return False, None
+    if pwd_context.identify(stored_password, required=False) is None:
+        if hmac.compare_digest(plain_password.encode(), stored_password.encode()):
+            return True, hash_password(plain_password)
+        return False, None
+    return pwd_context.verify_and_update(plain_password, stored_password)
+
+class PasswordHasher:
+    # bcrypt is CPU-bound and holds the GIL, so it runs on a process pool.
+    # Work beyond max_pending is rejected with 503 instead of queueing up
+    # behind a login storm.
+    def __init__(self, workers=PASSWORD_WORKERS, max_pending=PASSWORD_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.stats = {"hashed": 0, "verified": 0, "rehashed": 0, "rejected": 0}
+
+    async def _submit(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise HTTPException(status_code=503, detail="Server is busy, try again later", headers={"Retry-After": "1"})
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password):
+        self.stats["hashed"] += 1
+        return await self._submit(hash_password, password)
+
+    async def verify(self, password, stored_password):
+        self.stats["verified"] += 1
+        valid, new_hash = await self._submit(verify_and_update_password, password, stored_password)
+        if new_hash is not None:
+            self.stats["rehashed"] += 1
+        return valid, new_hash
+
+    def snapshot(self):
+        return {**self.stats, "pending": self.pending, "workers": self.workers, "max_pending": self.max_pending, "rounds": BCRYPT_ROUNDS}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+password_hasher = None
+dummy_password_hash = None
+
+def get_password_hasher():
+    if password_hasher is None:
+        raise HTTPException(status_code=503, detail="Password hasher is not ready")
+    return password_hasher
+
+class SessionStore:
+    # Backends map a session id to the logged-in user's public fields. The
+    # pool is passed in so database-backed stores share its reader
+    # connections and its single writer.
+    async def get(self, pool, session_id):
+        raise NotImplementedError
+
+    async def set(self, pool, session_id, user, ttl=SESSION_TTL):
+        raise NotImplementedError
+
+    async def delete(self, pool, session_id):
+        raise NotImplementedError
+
+class InMemorySessionStore(SessionStore):
+    def __init__(self, max_entries=SESSION_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, pool, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return user
+
+    async def set(self, pool, session_id, user, ttl=SESSION_TTL):
+        with self._lock:
+            self._sessions[session_id] = (time.monotonic() + ttl, user)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    async def delete(self, pool, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+def get_session(conn, session_id, now):
+    cursor = conn.cursor()
+    cursor.execute('SELECT user FROM sessions WHERE id = ? AND expires_at > ?', (session_id, now))
+    row = cursor.fetchone()
+    return json.loads(row[0]) if row else None
+
+def save_session(conn, session_id, user, now, ttl, purge):
+    cursor = conn.cursor()
+    cursor.execute('INSERT OR REPLACE INTO sessions (id, user, expires_at) VALUES (?, ?, ?)', (session_id, json.dumps(user), now + ttl))
+    if purge:
+        cursor.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,))
+    conn.commit()
+
+def delete_session(conn, session_id):
+    conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+    conn.commit()
+
+class SqliteSessionStore(SessionStore):
+    # Sessions in the database are visible to every worker process. Expired
+    # rows are skipped on read and purged at most once per
+    # SESSION_PURGE_INTERVAL.
+    def __init__(self):
+        self._purged_at = 0.0
+
+    async def get(self, pool, session_id):
+        return await pool.read(get_session, session_id, time.time())
+
+    async def set(self, pool, session_id, user, ttl=SESSION_TTL):
+        now = time.time()
+        purge = now - self._purged_at > SESSION_PURGE_INTERVAL
+        if purge:
+            self._purged_at = now
+        await pool.write(save_session, session_id, user, now, ttl, purge)
+
+    async def delete(self, pool, session_id):
+        await pool.write(delete_session, session_id)
+
+SESSION_BACKENDS = {"memory": InMemorySessionStore, "sqlite": SqliteSessionStore}
+
+def create_session_store(backend=SESSION_BACKEND):
+    if backend not in SESSION_BACKENDS:
+        raise ValueError(f"Unknown session backend '{backend}', expected one of {sorted(SESSION_BACKENDS)}")
+    return SESSION_BACKENDS[backend]()
+
+session_store = create_session_store()
+
+def sign_session_id(session_id):
+    return hmac.new(SECRET_KEY.encode(), session_id.encode(), hashlib.sha256).hexdigest()
+
+async def issue_session_token(pool, user):
+    session_id = secrets.token_urlsafe(24)
+    await session_store.set(pool, session_id, user)
+    return f"{session_id}.{sign_session_id(session_id)}"
+
+def session_id_from_token(token):
+    # Forged or truncated tokens are rejected by the signature check before
+    # the store is consulted.
+    session_id, _, signature = token.partition('.')
+    if not session_id or not hmac.compare_digest(signature, sign_session_id(session_id)):
+        return None
+    return session_id
+
+async def get_current_session(authorization: Optional[str] = Header(None), pool: ConnectionPool = Depends(get_db_pool)):
+    scheme, _, token = (authorization or '').partition(' ')
+    session_id = session_id_from_token(token) if scheme.lower() == 'bearer' else None
+    user = await session_store.get(pool, session_id) if session_id else None
+    if user is None:
+        raise HTTPException(status_code=401, detail="Not logged in", headers={"WWW-Authenticate": "Bearer"})
+    return {"id": session_id, "user": user}
+
+def get_current_user(session: dict = Depends(get_current_session)):
+    return session["user"]
+
+def require_admin(user: dict = Depends(get_current_user)):
+    if user["role"] != 'admin':
+        raise HTTPException(status_code=403, detail="Administrator access required")
+    return user
+
 def add_user(conn, username, password, role, full_name, address, payment_info):
     cursor = conn.cursor()
     hashed_password = hash_password(password)
@@ -106,17 +1185,158 @@ def authenticate_user(conn, username, password):
     else:
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
-def get_all_products(conn):
+def create_user(conn, user, password):
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM products')
-    products = cursor.fetchall()
-    return [{"id": product[0], "name": product[1], "category": product[2], "price": product[3], "thumbnail_url": product[4]} for product in products]
+    try:
+        cursor.execute("INSERT INTO users (username, password, role, full_name, address, payment_info) VALUES (?, ?, 'user', ?, ?, ?)",
+                       (user.username, password, user.full_name, user.address, user.payment_info))
+        conn.commit()
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=400, detail="Username already exists")
+    return {**user.dict(), "id": cursor.lastrowid}
 
-def add_product(conn, name, category, price, thumbnail_url):
+def get_login_user(conn, username):
     cursor = conn.cursor()
-    cursor.execute('INSERT INTO products (name, category, price, thumbnail_url) VALUES (?, ?, ?, ?)', (name, category, price, thumbnail_url))
+    cursor.execute('SELECT id, username, full_name, address, payment_info, role, password FROM users WHERE username = ?', (username,))
+    return cursor.fetchone()
+
+def update_password_hash(conn, user_id, hashed_password):
+    cursor = conn.cursor()
+    cursor.execute('UPDATE users SET password = ? WHERE id = ?', (hashed_password, user_id))
     conn.commit()
-    return {"message": "Product added successfully!"}
+
+def admin_exists(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT id FROM users WHERE role='admin'")
+    return cursor.fetchone() is not None
+
+def create_admin(conn, hashed_password):
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO users (username, password, role, full_name) VALUES ('admin', ?, 'admin', 'Admin User')", (hashed_password,))
+    conn.commit()
+
+def get_catalog_version(conn):
+    cursor = conn.cursor()
+    cursor.execute('SELECT version FROM catalog_version WHERE id = 1')
+    return cursor.fetchone()[0]
+
+def build_filters(conditions):
+    # conditions is a list of (sql, value) pairs; pairs whose value is None are skipped
+    active = [(sql, value) for sql, value in conditions if value is not None]
+    where = ' WHERE ' + ' AND '.join(sql for sql, _ in active) if active else ''
+    return where, [value for _, value in active]
+
+def select_page(conn, query, conditions, limit):
+    where, params = build_filters(conditions)
+    query += where + ' ORDER BY id'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+def count_rows(conn, table, conditions):
+    where, params = build_filters(conditions)
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT COUNT(*) FROM {table}' + where, params)
+    return cursor.fetchone()[0]
+
+def paginate(conn, fetch, count, limit, after_id, cursor_of=None, **filters):
+    items = fetch(conn, limit=limit, after_id=after_id, **filters)
+    next_cursor = None
+    if limit is not None and len(items) == limit:
+        next_cursor = cursor_of(items[-1]) if cursor_of is not None else items[-1]["id"]
+    return items, count(conn, **filters), next_cursor
+
+def product_conditions(category=None, min_price=None, max_price=None):
+    return [('category = ?', category), ('price >= ?', min_price), ('price <= ?', max_price)]
+
+def product_to_dict(product):
+    return {"id": product[0], "name": product[1], "category": product[2], "price": product[3], "thumbnail_url": product[4],
+            "thumbnail_hash": product[5]}
+
+def get_all_products(conn, limit=None, after_id=None, **filters):
+    products = select_page(conn, 'SELECT id, name, category, price, thumbnail_url, thumbnail_hash FROM products',
+                           [('id > ?', after_id), *product_conditions(**filters)], limit)
+    return [product_to_dict(product) for product in products]
+
+def count_products(conn, **filters):
+    return count_rows(conn, 'products', product_conditions(**filters))
+
+def build_match_query(text, column=None):
+    # Every word must match; the last one also matches as a prefix so partial
+    # input autocompletes. Words are quoted so user input can't inject FTS5
+    # query syntax.
+    words = re.findall(r'\w+', text.lower())
+    if not words:
+        return None
+    match = ' '.join(f'"{word}"' for word in words) + '*'
+    return f'{column} : ({match})' if column else match
+
+def search_products(conn, text, limit, offset):
+    match = build_match_query(text)
+    if match is None:
+        return [], 0
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT products.id, products.name, products.category, products.price, products.thumbnail_url, products.thumbnail_hash
+        FROM products_fts JOIN products ON products.id = products_fts.rowid
+        WHERE products_fts MATCH ?
+        ORDER BY bm25(products_fts, 10.0, 1.0)
+        LIMIT ? OFFSET ?
+    ''', (match, limit, offset))
+    products = [product_to_dict(product) for product in cursor.fetchall()]
+    cursor.execute('SELECT COUNT(*) FROM products_fts WHERE products_fts MATCH ?', (match,))
+    return products, cursor.fetchone()[0]
+
+def autocomplete_products(conn, text, limit):
+    match = build_match_query(text, column='name')
+    if match is None:
+        return []
+    cursor = conn.cursor()
+    cursor.execute('SELECT name FROM products_fts WHERE products_fts MATCH ? ORDER BY rank LIMIT ?', (match, limit))
+    return [row[0] for row in cursor.fetchall()]
+
+def add_product(conn, name, category, price, thumbnail_url, stock=None):
+    cursor = conn.cursor()
+    cursor.execute('INSERT INTO products (name, category, price, thumbnail_url, stock) VALUES (?, ?, ?, ?, ?)',
+                   (name, category, price, thumbnail_url, stock))
+    conn.commit()
+    product_cache.invalidate()
+    return {"message": "Product added successfully!", "id": cursor.lastrowid}
+
+def set_thumbnail_hash(conn, thumbnail_url, thumbnail_hash):
+    cursor = conn.cursor()
+    cursor.execute('UPDATE products SET thumbnail_hash = ? WHERE thumbnail_url = ?', (thumbnail_hash, thumbnail_url))
+    conn.commit()
+    if cursor.rowcount:
+        product_cache.invalidate()
+
+def get_uncached_thumbnail_urls(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT thumbnail_url FROM products WHERE thumbnail_hash IS NULL AND thumbnail_url IS NOT NULL AND thumbnail_url != ''")
+    return [row[0] for row in cursor.fetchall()]
+
+def get_thumbnail_url_by_hash(conn, thumbnail_hash):
+    cursor = conn.cursor()
+    cursor.execute('SELECT thumbnail_url FROM products WHERE thumbnail_hash = ? LIMIT 1', (thumbnail_hash,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+async def cache_thumbnail(pool, store, thumbnail_url):
+    try:
+        digest = await store.fetch(thumbnail_url)
+    except Exception as e:
+        logging.getLogger(__name__).warning("Could not cache thumbnail %.80s: %s", thumbnail_url, e)
+        return None
+    await pool.write(set_thumbnail_hash, thumbnail_url, digest)
+    return digest
+
+async def cache_missing_thumbnails(pool, store):
+    thumbnail_urls = await pool.read(get_uncached_thumbnail_urls)
+    digests = await asyncio.gather(*(cache_thumbnail(pool, store, thumbnail_url) for thumbnail_url in thumbnail_urls))
+    return sum(digest is not None for digest in digests)
 
 def delete_product(conn, product_name):
     cursor = conn.cursor()
@@ -124,6 +1344,7 @@ def delete_product(conn, product_name):
     if cursor.rowcount == 0:
         raise HTTPException(status_code=404, detail=f"Product '{product_name}' not found")
     conn.commit()
+    product_cache.invalidate()
     return {"message": f"Product '{product_name}' deleted successfully!"}
 
 def update_user_info(conn, username, full_name, address, payment_info):
@@ -137,62 +1358,637 @@ def get_user_by_username(conn, username):
     cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
     return cursor.fetchone()
 
-def get_all_users(conn):
+def user_conditions(role=None):
+    return [('role = ?', role)]
+
+def get_all_users(conn, limit=None, after_id=None, **filters):
+    users = select_page(conn, 'SELECT id, username, full_name, address, payment_info, role FROM users',
+                        [('id > ?', after_id), *user_conditions(**filters)], limit)
+    return [{"id": user[0], "username": user[1], "full_name": user[2], "address": user[3], "payment_info": user[4], "role": user[5]} for user in users]
+
+def count_users(conn, **filters):
+    return count_rows(conn, 'users', user_conditions(**filters))
+
+INSERT_PURCHASE_QUERY = '''
+    INSERT INTO purchases (buyer_id, product_id, purchase_time, payment_status, buyer_address, quantity, unit_price)
+    VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, (SELECT price FROM products WHERE id = ?)))
+'''
+
+def add_purchase(conn, buyer_id, product_id, payment_status, buyer_address, quantity=1):
+    # Takes the units from stock the same way checkout does, so single
+    # purchases cannot oversell a limited product either.
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users')
-    users = cursor.fetchall()
-    return [{"username": user[0], "full_name": user[1], "address": user[2], "payment_info": user[3]} for user in users]
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        if find_missing_products(cursor, [product_id]):
+            raise HTTPException(status_code=404, detail="Product not found")
+        if take_stock(cursor, {product_id: quantity}):
+            raise HTTPException(status_code=409, detail=f"Insufficient stock for products: {[product_id]}")
+        purchase_time = datetime.now().isoformat()
+        cursor.execute(INSERT_PURCHASE_QUERY, purchase_params(buyer_id, product_id, purchase_time, payment_status, buyer_address, quantity))
+        cursor.execute(RECORD_SALE_QUERY, sale_params(purchase_time, product_id, payment_status, quantity))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {"message": "Purchase added successfully!"}
+
+def purchase_params(buyer_id, product_id, purchase_time, payment_status, buyer_address, quantity, unit_price=None):
+    return (buyer_id, product_id, purchase_time, payment_status, buyer_address, quantity, unit_price, product_id)
+
+def sale_params(purchase_time, product_id, payment_status, quantity, unit_price=None):
+    return (purchase_time[:13], product_id, payment_status, quantity, quantity, unit_price, product_id)
+
+def order_request_hash(order):
+    return hashlib.sha256(json.dumps(order.model_dump(), sort_keys=True).encode()).hexdigest()
+
+def item_quantities(items):
+    quantities = {}
+    for item in items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    return quantities
+
+def take_stock(cursor, quantities):
+    # Check and decrement in one statement, so concurrent buyers (even from
+    # other processes) can never take the same units. Returns the products
+    # that did not have enough left; the caller rolls back.
+    short = []
+    for product_id, quantity in quantities.items():
+        if quantity <= 0:
+            continue
+        cursor.execute('UPDATE products SET stock = stock - ? WHERE id = ? AND (stock IS NULL OR stock >= ?)',
+                       (quantity, product_id, quantity))
+        if cursor.rowcount == 0:
+            short.append(product_id)
+    return short
+
+def release_stock(cursor, quantities):
+    cursor.executemany('UPDATE products SET stock = stock + ? WHERE id = ? AND stock IS NOT NULL',
+                       [(quantity, product_id) for product_id, quantity in quantities.items() if quantity > 0])
+
+def find_missing_products(cursor, product_ids):
+    cursor.execute(f'SELECT id FROM products WHERE id IN ({", ".join("?" * len(product_ids))})', product_ids)
+    found = {row[0] for row in cursor.fetchall()}
+    return [product_id for product_id in product_ids if product_id not in found]
+
+def pop_reservation(cursor, buyer_id, reservation_id, now):
+    cursor.execute('SELECT id FROM reservations WHERE id = ? AND buyer_id = ? AND expires_at > ?', (reservation_id, buyer_id, now))
+    if cursor.fetchone() is None:
+        raise HTTPException(status_code=404, detail="Reservation not found or expired")
+    cursor.execute('SELECT product_id, quantity FROM reservation_items WHERE reservation_id = ?', (reservation_id,))
+    reserved = dict(cursor.fetchall())
+    cursor.execute('DELETE FROM reservation_items WHERE reservation_id = ?', (reservation_id,))
+    cursor.execute('DELETE FROM reservations WHERE id = ?', (reservation_id,))
+    return reserved
+
+def reserve(conn, buyer_id, reservation, ttl=RESERVATION_TTL):
+    quantities = item_quantities(reservation.items)
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        missing = find_missing_products(cursor, list(quantities))
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Products not found: {missing}")
+        short = take_stock(cursor, quantities)
+        if short:
+            raise HTTPException(status_code=409, detail=f"Insufficient stock for products: {short}")
+        created_at = datetime.now()
+        expires_at = (created_at + timedelta(seconds=ttl)).isoformat()
+        cursor.execute('INSERT INTO reservations (buyer_id, created_at, expires_at) VALUES (?, ?, ?)',
+                       (buyer_id, created_at.isoformat(), expires_at))
+        reservation_id = cursor.lastrowid
+        cursor.executemany('INSERT INTO reservation_items (reservation_id, product_id, quantity) VALUES (?, ?, ?)',
+                           [(reservation_id, product_id, quantity) for product_id, quantity in quantities.items()])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {"id": reservation_id, "expires_at": expires_at,
+            "items": [{"product_id": product_id, "quantity": quantity} for product_id, quantity in quantities.items()]}
+
+def cancel_reservation(conn, buyer_id, reservation_id):
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        release_stock(cursor, pop_reservation(cursor, buyer_id, reservation_id, datetime.now().isoformat()))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {"message": "Reservation cancelled"}
 
-def add_purchase(conn, buyer_id, product_id, payment_status, buyer_address):
+def expire_reservations(conn, now=None):
+    now = now or datetime.now().isoformat()
     cursor = conn.cursor()
-    purchase_time = datetime.now().isoformat()
-    cursor.execute('INSERT INTO purchases (buyer_id, product_id, purchase_time, payment_status, buyer_address) VALUES (?, ?, ?, ?, ?)',
-                   (buyer_id, product_id, purchase_time, payment_status, buyer_address))
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.execute('''
+            SELECT reservation_items.product_id, SUM(reservation_items.quantity)
+            FROM reservations JOIN reservation_items ON reservation_items.reservation_id = reservations.id
+            WHERE reservations.expires_at <= ?
+            GROUP BY reservation_items.product_id
+        ''', (now,))
+        release_stock(cursor, dict(cursor.fetchall()))
+        cursor.execute('DELETE FROM reservation_items WHERE reservation_id IN (SELECT id FROM reservations WHERE expires_at <= ?)', (now,))
+        cursor.execute('DELETE FROM reservations WHERE expires_at <= ?', (now,))
+        expired = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return expired
+
+def get_stock(conn, product_id):
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT stock, (SELECT COALESCE(SUM(reservation_items.quantity), 0)
+                       FROM reservation_items JOIN reservations ON reservations.id = reservation_items.reservation_id
+                       WHERE reservation_items.product_id = products.id AND reservations.expires_at > ?)
+        FROM products WHERE id = ?
+    ''', (datetime.now().isoformat(), product_id))
+    row = cursor.fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return {"product_id": product_id, "stock": row[0], "reserved": row[1]}
+
+def set_stock(conn, product_id, stock):
+    cursor = conn.cursor()
+    cursor.execute('UPDATE products SET stock = ? WHERE id = ?', (stock, product_id))
+    if cursor.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Product not found")
     conn.commit()
-    return {"message": "Purchase added successfully!"}
+    return {"product_id": product_id, "stock": stock}
+
+async def sweep_reservations(pool, interval=RESERVATION_SWEEP_INTERVAL):
+    # Returns the stock held by abandoned reservations once they expire.
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            expired = await pool.write(expire_reservations)
+        except Exception as e:
+            logging.getLogger(__name__).warning("Could not expire reservations: %s", e)
+            continue
+        if expired:
+            logging.getLogger(__name__).info("Expired %d reservations", expired)
 
-def get_all_purchases(conn):
+def checkout(conn, buyer_id, order, idempotency_key=None):
+    # The whole basket is priced, taken from stock and written in one
+    # transaction, so it costs a single commit and either all of it sells or
+    # none of it does. A retried request with the same idempotency key gets
+    # the order that was already placed instead of a second one.
+    request_hash = order_request_hash(order)
+    quantities = item_quantities(order.items)
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM purchases')
-    purchases = cursor.fetchall()
-    return [{"buyer_id": purchase[1], "product_id": purchase[2], "purchase_time": purchase[3], "payment_status": purchase[4], "buyer_address": purchase[5]} for purchase in purchases]
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        if idempotency_key is not None:
+            cursor.execute('SELECT id, request_hash FROM orders WHERE buyer_id = ? AND idempotency_key = ?', (buyer_id, idempotency_key))
+            existing = cursor.fetchone()
+            if existing is not None:
+                conn.rollback()
+                if existing[1] != request_hash:
+                    raise HTTPException(status_code=409, detail="Idempotency key was already used for a different order")
+                return get_order(conn, existing[0]), True
+        product_ids = list(quantities)
+        cursor.execute(f'SELECT id, price FROM products WHERE id IN ({", ".join("?" * len(product_ids))})', product_ids)
+        prices = dict(cursor.fetchall())
+        missing = [product_id for product_id in product_ids if product_id not in prices]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Products not found: {missing}")
+        created_at = datetime.now().isoformat()
+        # Units held by the reservation are already out of stock; only the
+        # difference is taken now and anything reserved but not bought goes back.
+        reserved = pop_reservation(cursor, buyer_id, order.reservation_id, created_at) if order.reservation_id is not None else {}
+        short = take_stock(cursor, {product_id: quantity - reserved.get(product_id, 0) for product_id, quantity in quantities.items()})
+        if short:
+            raise HTTPException(status_code=409, detail=f"Insufficient stock for products: {short}")
+        release_stock(cursor, {product_id: quantity - quantities.get(product_id, 0) for product_id, quantity in reserved.items()})
+        total = round(sum(quantity * prices[product_id] for product_id, quantity in quantities.items()), 2)
+        cursor.execute('INSERT INTO orders (buyer_id, idempotency_key, request_hash, created_at, payment_status, buyer_address, total) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (buyer_id, idempotency_key, request_hash, created_at, order.payment_status, order.buyer_address, total))
+        order_id = cursor.lastrowid
+        cursor.executemany('INSERT INTO order_items (order_id, product_id, quantity, unit_price) VALUES (?, ?, ?, ?)',
+                           [(order_id, product_id, quantity, prices[product_id]) for product_id, quantity in quantities.items()])
+        cursor.executemany(RECORD_SALE_QUERY, [sale_params(created_at, product_id, order.payment_status, quantity, prices[product_id])
+                                               for product_id, quantity in quantities.items()])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return get_order(conn, order_id), False
 
-@app.on_event("startup")
-async def startup_event():
-    create_tables()
-    conn = create_connection()
+def order_to_dict(order, items):
+    return {"id": order[0], "buyer_id": order[1], "created_at": order[2], "payment_status": order[3], "buyer_address": order[4],
+            "total": order[5], "items": items}
+
+def get_order_items(conn, order_ids):
+    items = {order_id: [] for order_id in order_ids}
+    if order_ids:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT order_id, product_id, quantity, unit_price FROM order_items WHERE order_id IN ({", ".join("?" * len(order_ids))})',
+                       order_ids)
+        for order_id, product_id, quantity, unit_price in cursor.fetchall():
+            items[order_id].append({"product_id": product_id, "quantity": quantity, "unit_price": unit_price})
+    return items
+
+def get_order(conn, order_id):
     cursor = conn.cursor()
-    cursor.execute("SELECT id FROM users WHERE role='admin'")
-    admin_exists = cursor.fetchone()
-    if not admin_exists:
-        cursor.execute("INSERT INTO users (username, password, role, full_name) VALUES ('admin', 'admin', 'admin', 'Admin User')")
+    cursor.execute('SELECT id, buyer_id, created_at, payment_status, buyer_address, total FROM orders WHERE id = ?', (order_id,))
+    order = cursor.fetchone()
+    if order is None:
+        return None
+    return order_to_dict(order, get_order_items(conn, [order_id])[order_id])
+
+def order_conditions(buyer_id=None, since=None, until=None):
+    return [('buyer_id = ?', buyer_id), ('created_at >= ?', since), ('created_at < ?', until)]
+
+def get_all_orders(conn, limit=None, after_id=None, **filters):
+    orders = select_page(conn, 'SELECT id, buyer_id, created_at, payment_status, buyer_address, total FROM orders',
+                         [('id > ?', after_id), *order_conditions(**filters)], limit)
+    items = get_order_items(conn, [order[0] for order in orders])
+    return [order_to_dict(order, items[order[0]]) for order in orders]
+
+def count_orders(conn, **filters):
+    return count_rows(conn, 'orders', order_conditions(**filters))
+
+def rebuild_sales_aggregates(conn):
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.execute('DELETE FROM sales_hourly')
+        cursor.execute(REBUILD_SALES_QUERY)
         conn.commit()
-    conn.close()
+    except Exception:
+        conn.rollback()
+        raise
+    cursor.execute('SELECT COUNT(*), COALESCE(SUM(purchases), 0) FROM sales_hourly')
+    buckets, purchases = cursor.fetchone()
+    return {"buckets": buckets, "purchases": purchases}
 
-@app.post("/register", response_model=User)
-async def register_user(user: User, password: str):
-    conn = create_connection()
+SALES_DIMENSIONS = {
+    "product": [("s.product_id", "product_id"), ("p.name", "product_name")],
+    "category": [("p.category", "category")],
+    "day": [("substr(s.hour, 1, 10)", "day")],
+    "hour": [("s.hour", "hour")],
+    "payment_status": [("s.payment_status", "payment_status")],
+}
+
+def get_sales(conn, group_by, since=None, until=None, product_id=None, category=None, payment_status=None):
+    columns = [column for dimension in group_by for column in SALES_DIMENSIONS[dimension]]
+    expressions = [expression for expression, _ in columns]
+    where, params = build_filters([('s.hour >= substr(?, 1, 13)', since), ('s.hour < substr(?, 1, 13)', until),
+                                   ('s.product_id = ?', product_id), ('p.category = ?', category),
+                                   ('s.payment_status = ?', payment_status)])
+    query = 'SELECT ' + ''.join(f'{expression}, ' for expression in expressions) + 'SUM(s.purchases), ROUND(SUM(s.revenue), 2)'
+    query += ' FROM sales_hourly s LEFT JOIN products p ON p.id = s.product_id' + where
+    if expressions:
+        query += ' GROUP BY ' + ', '.join(expressions) + ' ORDER BY ' + ', '.join(expressions)
     cursor = conn.cursor()
+    cursor.execute(query, params)
+    keys = [key for _, key in columns] + ["purchases", "revenue"]
+    return [dict(zip(keys, row)) for row in cursor.fetchall()]
+
+# A purchase is either a purchases row (/add_purchase, /purchases/bulk) or
+# a line of an order placed through /checkout. Both are listed as one log
+# ordered by purchase_key(): (time, source, id, product_id), where source 0
+# is purchases and 1 is order lines. Each source is read in that order from
+# its own index and the two pages are merged.
+PURCHASE_SOURCES = [
+    {"from": 'purchases pu', "time": 'pu.purchase_time', "ref": 'pu.id', "product": 'pu.product_id',
+     "buyer": 'pu.buyer_id', "status": 'pu.payment_status', "key": ['pu.purchase_time', 'pu.id'],
+     "columns": {"id": 'pu.id', "order_id": 'NULL', "buyer_id": 'pu.buyer_id', "product_id": 'pu.product_id',
+                 "purchase_time": 'pu.purchase_time', "payment_status": 'pu.payment_status', "buyer_address": 'pu.buyer_address',
+                 "quantity": 'pu.quantity', "unit_price": 'pu.unit_price'}},
+    {"from": 'orders o JOIN order_items oi ON oi.order_id = o.id', "time": 'o.created_at', "ref": 'o.id', "product": 'oi.product_id',
+     "buyer": 'o.buyer_id', "status": 'o.payment_status', "key": ['o.created_at', 'o.id', 'oi.product_id'],
+     "columns": {"id": 'NULL', "order_id": 'o.id', "buyer_id": 'o.buyer_id', "product_id": 'oi.product_id',
+                 "purchase_time": 'o.created_at', "payment_status": 'o.payment_status', "buyer_address": 'o.buyer_address',
+                 "quantity": 'oi.quantity', "unit_price": 'oi.unit_price'}},
+]
+PURCHASE_FIELDS = ["id", "order_id", "buyer_id", "product_id", "purchase_time", "payment_status", "buyer_address", "quantity", "unit_price"]
+PRODUCT_COLUMNS = {"product_name": 'p.name', "price": 'p.price'}
+
+def purchase_key(purchase):
+    if purchase["order_id"] is None:
+        return [purchase["purchase_time"], 0, purchase["id"], purchase["product_id"]]
+    return [purchase["purchase_time"], 1, purchase["order_id"], purchase["product_id"]]
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_purchase_cursor(token):
+    if token is None:
+        return None
     try:
-        cursor.execute("INSERT INTO users (username, password, role, full_name, address, payment_info) VALUES (?, ?, 'user', ?, ?, ?)",
-                       (user.username, password, user.full_name, user.address, user.payment_info))
+        key = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        time_value, source, ref, product_id = key
+        if not isinstance(time_value, str) or source not in (0, 1) or not isinstance(ref, int) or not isinstance(product_id, int):
+            raise ValueError(key)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
+
+def purchase_source_conditions(source, buyer_id=None, product_id=None, payment_status=None, since=None, until=None):
+    return [(f'{source["buyer"]} = ?', buyer_id), (f'{source["product"]} = ?', product_id), (f'{source["status"]} = ?', payment_status),
+            (f'{source["time"]} >= ?', since), (f'{source["time"]} < ?', until)]
+
+def purchase_keyset_condition(index, source, after, descending):
+    after_time, after_source, ref, product_id = after
+    operator = '<' if descending else '>'
+    if index == after_source:
+        key = source["key"]
+        return f'({", ".join(key)}) {operator} ({", ".join("?" * len(key))})', [after_time, ref, product_id][:len(key)]
+    # The other source's rows at the cursor's exact time sort together on
+    # one side of it.
+    inclusive = (index > after_source) != descending
+    return f'{source["time"]} {operator}{"=" if inclusive else ""} ?', [after_time]
+
+def select_purchases(conn, fields, limit=None, after=None, descending=False, with_products=False, **filters):
+    direction = ' DESC' if descending else ''
+    parts, params = [], []
+    for index, source in enumerate(PURCHASE_SOURCES):
+        where, source_params = build_filters(purchase_source_conditions(source, **filters))
+        if after is not None:
+            condition, values = purchase_keyset_condition(index, source, after, descending)
+            where += (' AND ' if where else ' WHERE ') + condition
+            source_params += values
+        columns = ', '.join(source["columns"].get(field) or PRODUCT_COLUMNS[field] for field in fields)
+        joins = f' LEFT JOIN products p ON p.id = {source["product"]}' if with_products else ''
+        query = (f'SELECT {columns}, {source["time"]} AS key_time, {index} AS key_source, {source["ref"]} AS key_ref, '
+                 f'{source["product"]} AS key_product FROM {source["from"]}{joins}{where} '
+                 f'ORDER BY ' + ', '.join(column + direction for column in source["key"]))
+        if limit is not None:
+            query += ' LIMIT ?'
+            source_params.append(limit)
+        parts.append(f'SELECT * FROM ({query})')
+        params += source_params
+    query = ' UNION ALL '.join(parts) + ' ORDER BY ' + ', '.join(key + direction for key in ('key_time', 'key_source', 'key_ref', 'key_product'))
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    return [dict(zip(fields, row)) for row in cursor.fetchall()]
+
+def get_all_purchases(conn, limit=None, after_id=None, **filters):
+    # after_id is the purchase_key() of the last purchase already listed.
+    return select_purchases(conn, PURCHASE_FIELDS, limit, after_id, **filters)
+
+def count_purchases(conn, **filters):
+    total = 0
+    cursor = conn.cursor()
+    for source in PURCHASE_SOURCES:
+        where, params = build_filters(purchase_source_conditions(source, **filters))
+        cursor.execute(f'SELECT COUNT(*) FROM {source["from"]}' + where, params)
+        total += cursor.fetchone()[0]
+    return total
+
+USER_PURCHASE_FIELDS = ["id", "order_id", "product_id", "product_name", "price", "purchase_time", "payment_status", "quantity", "unit_price"]
+
+def get_user_purchases(conn, limit=None, after_id=None, buyer_id=None):
+    # Newest first, so the page after after_id (a purchase_key()) holds the
+    # purchases older than it.
+    return select_purchases(conn, USER_PURCHASE_FIELDS, limit, after_id, descending=True, with_products=True, buyer_id=buyer_id)
+
+async def iter_purchase_batches(pool, batch_size=EXPORT_BATCH_SIZE, **filters):
+    # Each batch is its own short keyset query, so a slow client never pins a
+    # reader connection or holds a read transaction open for the whole export.
+    after = None
+    while True:
+        purchases = await pool.read(get_all_purchases, limit=batch_size, after_id=after, **filters)
+        if not purchases:
+            return
+        yield purchases
+        after = purchase_key(purchases[-1])
+
+async def export_purchases_ndjson(pool, **filters):
+    async for purchases in iter_purchase_batches(pool, **filters):
+        yield ''.join(json.dumps(purchase) + '\n' for purchase in purchases)
+
+async def export_purchases_csv(pool, **filters):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=PURCHASE_FIELDS)
+    writer.writeheader()
+    async for purchases in iter_purchase_batches(pool, **filters):
+        writer.writerows(purchases)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+async def iter_body_lines(request):
+    # Yields raw lines with their b'\n'. Splitting bytes is safe because no
+    # UTF-8 multi-byte sequence contains a newline byte.
+    pending = b''
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            yield line + b'\n'
+    if pending:
+        yield pending
+
+async def iter_csv_records(request):
+    # A CSV record ends at the first newline outside quotes, which is where
+    # the quotes seen so far pair up; escaped quotes ("") come in pairs too.
+    record = []
+    quotes = 0
+    async for line in iter_body_lines(request):
+        record.append(line)
+        quotes += line.count(b'"')
+        if quotes % 2 == 0:
+            yield record
+            record = []
+            quotes = 0
+    if record:
+        yield record
+
+def decode_lines(lines):
+    try:
+        return [line.decode() for line in lines]
+    except UnicodeDecodeError:
+        raise ValueError("Row is not valid UTF-8")
+
+async def iter_bulk_rows(request, model):
+    # Yields (row number, parsed row); rows that fail to parse are yielded as
+    # the exception so the caller can report them alongside validation errors.
+    content_type = request.headers.get('content-type', '').split(';')[0].strip()
+    if content_type == 'application/json':
+        try:
+            rows = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Request body is not valid JSON")
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array")
+        for index, row in enumerate(rows):
+            yield index, row
+    elif content_type == 'application/x-ndjson':
+        index = 0
+        async for line in iter_body_lines(request):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(decode_lines([line])[0])
+            except ValueError as e:
+                row = e
+            yield index, row
+            index += 1
+    elif content_type == 'text/csv':
+        # CSV has no null, so an empty cell leaves an optional field unset.
+        optional = {name for name, field in model.model_fields.items() if not field.is_required()}
+        header = None
+        index = 0
+        async for record in iter_csv_records(request):
+            if not b''.join(record).strip():
+                continue
+            try:
+                values = next(csv.reader(decode_lines(record)))
+            except (ValueError, csv.Error) as e:
+                if header is None:
+                    raise HTTPException(status_code=400, detail=f"Invalid CSV header: {e}")
+                values = e
+            if header is None:
+                header = values
+                continue
+            if isinstance(values, Exception):
+                yield index, values
+            else:
+                yield index, {key: None if value == '' and key in optional else value for key, value in zip(header, values)}
+            index += 1
+    else:
+        raise HTTPException(status_code=415, detail="Send application/json, application/x-ndjson or text/csv")
+
+def insert_bulk_chunk(conn, statements, rows):
+    # statements is a list of (query, to_params) run for every row. Fast path:
+    # one executemany per statement in one transaction. If any row violates a
+    # constraint, redo the chunk row by row under savepoints so only the
+    # offending rows are skipped.
+    cursor = conn.cursor()
+    try:
+        for query, to_params in statements:
+            cursor.executemany(query, [to_params(item) for _, item in rows])
         conn.commit()
-        user_id = cursor.lastrowid
-        return {**user.dict(), "id": user_id}
+        return len(rows), []
     except sqlite3.IntegrityError:
-        raise HTTPException(status_code=400, detail="Username already exists")
-    finally:
-        conn.close()
+        conn.rollback()
+    inserted = 0
+    errors = []
+    cursor.execute('BEGIN')
+    for index, item in rows:
+        cursor.execute('SAVEPOINT bulk_row')
+        try:
+            for query, to_params in statements:
+                cursor.execute(query, to_params(item))
+            inserted += 1
+        except sqlite3.IntegrityError as e:
+            cursor.execute('ROLLBACK TO SAVEPOINT bulk_row')
+            errors.append({"row": index, "error": str(e)})
+        cursor.execute('RELEASE SAVEPOINT bulk_row')
+    conn.commit()
+    return inserted, errors
+
+def insert_products_chunk(conn, rows):
+    inserted, errors = insert_bulk_chunk(conn, [
+        ('INSERT INTO products (name, category, price, thumbnail_url, stock) VALUES (?, ?, ?, ?, ?)',
+         lambda product: (product.name, product.category, product.price, product.thumbnail_url, product.stock)),
+    ], rows)
+    if inserted:
+        product_cache.invalidate()
+    return inserted, errors
+
+def insert_purchases_chunk(conn, rows):
+    return insert_bulk_chunk(conn, [
+        (INSERT_PURCHASE_QUERY, lambda purchase: purchase_params(purchase.buyer_id, purchase.product_id, purchase.purchase_time, purchase.payment_status,
+                                                                 purchase.buyer_address, purchase.quantity, purchase.unit_price)),
+        (RECORD_SALE_QUERY, lambda purchase: sale_params(purchase.purchase_time, purchase.product_id, purchase.payment_status,
+                                                         purchase.quantity, purchase.unit_price)),
+    ], rows)
+
+async def bulk_ingest(request, pool, model, insert_chunk):
+    started = time.perf_counter()
+    inserted = failed = 0
+    errors = []
+    chunk = []
+
+    def report(new_errors):
+        nonlocal failed
+        failed += len(new_errors)
+        errors.extend(new_errors[:BULK_MAX_REPORTED_ERRORS - len(errors)])
+
+    async for index, row in iter_bulk_rows(request, model):
+        if not isinstance(row, dict):
+            report([{"row": index, "error": str(row) if isinstance(row, Exception) else "Expected an object"}])
+            continue
+        try:
+            chunk.append((index, model(**row)))
+        except ValidationError as e:
+            report([{"row": index, "error": "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())}])
+            continue
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            count, chunk_errors = await pool.write(insert_chunk, chunk)
+            inserted += count
+            report(chunk_errors)
+            chunk = []
+    if chunk:
+        count, chunk_errors = await pool.write(insert_chunk, chunk)
+        inserted += count
+        report(chunk_errors)
+    elapsed = time.perf_counter() - started
+    return {"inserted": inserted, "failed": failed, "errors": errors,
+            "seconds": round(elapsed, 3), "rows_per_second": round(inserted / elapsed) if elapsed else inserted}
+
+def set_page_headers(headers, total, next_cursor):
+    headers["X-Total-Count"] = str(total)
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = str(next_cursor)
+
+@app.on_event("startup")
+async def startup_event():
+    global db_pool, password_hasher, thumbnail_store, reservation_sweeper, dummy_password_hash
+    await asyncio.get_running_loop().run_in_executor(None, initialize_database)
+    db_pool = ConnectionPool()
+    password_hasher = PasswordHasher()
+    thumbnail_store = ThumbnailStore()
+    reservation_sweeper = asyncio.create_task(sweep_reservations(db_pool))
+    dummy_password_hash = await password_hasher.hash(uuid.uuid4().hex)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    global db_pool, password_hasher, thumbnail_store, reservation_sweeper
+    if reservation_sweeper is not None:
+        reservation_sweeper.cancel()
+        try:
+            await reservation_sweeper
+        except asyncio.CancelledError:
+            pass
+        reservation_sweeper = None
+    if thumbnail_store is not None:
+        thumbnail_store.close()
+        thumbnail_store = None
+    if db_pool is not None:
+        db_pool.close()
+        db_pool = None
+    if password_hasher is not None:
+        password_hasher.close()
+        password_hasher = None
+
+@app.post("/register", response_model=User)
+async def register_user(user: User, password: str, pool: ConnectionPool = Depends(get_db_pool),
+                        hasher: PasswordHasher = Depends(get_password_hasher)):
+    return await pool.write(create_user, user, await hasher.hash(password))
 
 @app.get("/login")
-async def login(username: str, password: str):
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, username, full_name, address, payment_info, role FROM users WHERE username = ? AND password = ?', (username, password))
-    user = cursor.fetchone()
-    conn.close()
-    if user:
-        return {
+async def login(username: str, password: str, pool: ConnectionPool = Depends(get_db_pool),
+                hasher: PasswordHasher = Depends(get_password_hasher)):
+    user = await pool.read(get_login_user, username)
+    # Unknown usernames are checked against a throwaway hash so they cost the
+    # same as a wrong password and can't be told apart by timing.
+    valid, new_hash = await hasher.verify(password, user[6] if user else dummy_password_hash)
+    if user and valid:
+        if new_hash is not None:
+            await pool.write(update_password_hash, user[0], new_hash)
+        user_info = {
             "id": user[0],
             "username": user[1],
             "full_name": user[2],
@@ -200,54 +1996,288 @@ async def login(username: str, password: str):
             "payment_info": user[4],
             "role": user[5]
         }
+        return {**user_info, "token": await issue_session_token(pool, user_info)}
     else:
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
+@app.post("/logout")
+async def logout(session: dict = Depends(get_current_session), pool: ConnectionPool = Depends(get_db_pool)):
+    await session_store.delete(pool, session["id"])
+    return {"message": "Logged out successfully!"}
+
+@app.get("/me")
+async def get_me(user: dict = Depends(get_current_user)):
+    return user
+
 @app.get("/products", response_model=List[dict])
-async def get_products():
-    conn = create_connection()
-    products = get_all_products(conn)
-    conn.close()
+async def get_products(request: Request, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[int] = None,
+                       category: Optional[str] = None, min_price: Optional[float] = None, max_price: Optional[float] = None,
+                       pool: ConnectionPool = Depends(get_db_pool)):
+    key = (limit, cursor, category, min_price, max_price)
+    version = await product_cache.current_version(pool)
+    etag = product_cache.etag(key, version)
+    if etag_matches(request, etag):
+        product_cache.count("not_modified")
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    entry = product_cache.get(key)
+    if entry is None:
+        products, total, next_cursor = await pool.read(paginate, get_all_products, count_products, limit, cursor,
+                                                       category=category, min_price=min_price, max_price=max_price)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        set_page_headers(headers, total, next_cursor)
+        entry = (dump_json(products), headers)
+        product_cache.put(key, version, entry)
+    body, headers = entry
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/products/search", response_model=List[dict])
+async def search_products_endpoint(response: Response, q: str, limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE), offset: int = Query(0, ge=0),
+                                   pool: ConnectionPool = Depends(get_db_pool)):
+    products, total = await pool.read(search_products, q, limit, offset)
+    response.headers["X-Total-Count"] = str(total)
+    if offset + limit < total:
+        response.headers["X-Next-Offset"] = str(offset + limit)
     return products
 
-@app.post("/add_product")
-async def add_new_product(name: str, category: str, price: float, thumbnail_url: str):
-    conn = create_connection()
-    result = add_product(conn, name, category, price, thumbnail_url)
-    conn.close()
+@app.get("/products/autocomplete", response_model=List[str])
+async def autocomplete_products_endpoint(q: str, limit: int = Query(10, ge=1, le=50), pool: ConnectionPool = Depends(get_db_pool)):
+    return await pool.read(autocomplete_products, q, limit)
+
+@app.post("/add_product", dependencies=[Depends(require_admin)])
+async def add_new_product(name: str, category: str, price: float, thumbnail_url: str, background_tasks: BackgroundTasks,
+                          stock: Optional[int] = Query(None, ge=0), pool: ConnectionPool = Depends(get_db_pool),
+                          store: ThumbnailStore = Depends(get_thumbnail_store)):
+    result = await pool.write(add_product, name, category, price, thumbnail_url, stock)
+    if thumbnail_url:
+        background_tasks.add_task(cache_thumbnail, pool, store, thumbnail_url)
     return result
 
-@app.delete("/products/{product_name}")
-async def delete_product_endpoint(product_name: str):
-    conn = create_connection()
-    result = delete_product(conn, product_name)
-    conn.close()
+@app.post("/products/bulk", dependencies=[Depends(require_admin)])
+async def bulk_add_products(request: Request, background_tasks: BackgroundTasks, pool: ConnectionPool = Depends(get_db_pool),
+                            store: ThumbnailStore = Depends(get_thumbnail_store)):
+    result = await bulk_ingest(request, pool, Product, insert_products_chunk)
+    if result["inserted"]:
+        background_tasks.add_task(cache_missing_thumbnails, pool, store)
     return result
 
+@app.get("/products/{product_id}/stock")
+async def get_stock_endpoint(product_id: int, pool: ConnectionPool = Depends(get_db_pool)):
+    return await pool.read(get_stock, product_id)
+
+@app.put("/products/{product_id}/stock", dependencies=[Depends(require_admin)])
+async def set_stock_endpoint(product_id: int, stock: Optional[int] = Query(None, ge=0), pool: ConnectionPool = Depends(get_db_pool)):
+    return await pool.write(set_stock, product_id, stock)
+
+@app.get("/thumbnails/{digest}")
+async def get_thumbnail(request: Request, digest: str = Path(pattern="^[0-9a-f]{64}$"), width: Optional[int] = None,
+                        pool: ConnectionPool = Depends(get_db_pool), store: ThumbnailStore = Depends(get_thumbnail_store)):
+    if width is not None and width not in THUMBNAIL_WIDTHS:
+        raise HTTPException(status_code=400, detail=f"width must be one of {list(THUMBNAIL_WIDTHS)}")
+    # The URL names the content, so it can be cached forever.
+    headers = {"ETag": f'"{digest}-{width or "original"}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    path, media_type = store.open(digest, width)
+    if path is None and width is not None and await store.restore(digest, width):
+        path, media_type = store.open(digest, width)
+    if path is None:
+        # Evicted by the disk quota: fetch it again from the product's source URL.
+        thumbnail_url = await pool.read(get_thumbnail_url_by_hash, digest)
+        if thumbnail_url is None or await cache_thumbnail(pool, store, thumbnail_url) != digest:
+            raise HTTPException(status_code=404, detail="Thumbnail not found")
+        path, media_type = store.open(digest, width)
+        if path is None:
+            raise HTTPException(status_code=404, detail="Thumbnail not found")
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+@app.delete("/products/{product_name}", dependencies=[Depends(require_admin)])
+async def delete_product_endpoint(product_name: str, pool: ConnectionPool = Depends(get_db_pool)):
+    return await pool.write(delete_product, product_name)
+
 @app.post("/update_user_info")
-async def update_user_info_endpoint(username: str, full_name: str, address: str, payment_info: str):
-    conn = create_connection()
-    result = update_user_info(conn, username, full_name, address, payment_info)
-    conn.close()
+async def update_user_info_endpoint(full_name: str, address: str, payment_info: str, session: dict = Depends(get_current_session),
+                                    pool: ConnectionPool = Depends(get_db_pool)):
+    user = session["user"]
+    result = await pool.write(update_user_info, user["username"], full_name, address, payment_info)
+    await session_store.set(pool, session["id"], {**user, "full_name": full_name, "address": address, "payment_info": payment_info})
     return result
 
 @app.post("/add_purchase")
-async def add_purchase_endpoint(purchase: Purchase):
-    conn = create_connection()
-    result = add_purchase(conn, purchase.buyer_id, purchase.product_id, purchase.payment_status, purchase.buyer_address)
-    conn.close()
-    return result
+async def add_purchase_endpoint(purchase: Purchase, user: dict = Depends(get_current_user), pool: ConnectionPool = Depends(get_db_pool)):
+    if purchase.buyer_id != user["id"] and user["role"] != 'admin':
+        raise HTTPException(status_code=403, detail="Purchases can only be made for your own account")
+    return await pool.write(add_purchase, purchase.buyer_id, purchase.product_id, purchase.payment_status, purchase.buyer_address,
+                            purchase.quantity)
+
+@app.post("/checkout")
+async def checkout_endpoint(order: Order, response: Response, idempotency_key: Optional[str] = Header(None, max_length=255),
+                            user: dict = Depends(get_current_user), pool: ConnectionPool = Depends(get_db_pool)):
+    placed, replayed = await pool.write(checkout, user["id"], order, idempotency_key)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return placed
+
+@app.post("/reservations")
+async def reserve_endpoint(reservation: Reservation, user: dict = Depends(get_current_user), pool: ConnectionPool = Depends(get_db_pool)):
+    return await pool.write(reserve, user["id"], reservation)
+
+@app.delete("/reservations/{reservation_id}")
+async def cancel_reservation_endpoint(reservation_id: int, user: dict = Depends(get_current_user), pool: ConnectionPool = Depends(get_db_pool)):
+    return await pool.write(cancel_reservation, user["id"], reservation_id)
+
+@app.get("/orders")
+async def get_orders(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[int] = None,
+                     buyer_id: Optional[int] = None, since: Optional[str] = None, until: Optional[str] = None,
+                     user: dict = Depends(get_current_user), pool: ConnectionPool = Depends(get_db_pool)):
+    if user["role"] != 'admin':
+        if buyer_id not in (None, user["id"]):
+            raise HTTPException(status_code=403, detail="Orders can only be listed for your own account")
+        buyer_id = user["id"]
+    orders, total, next_cursor = await pool.read(paginate, get_all_orders, count_orders, limit, cursor,
+                                                 buyer_id=buyer_id, since=since, until=until)
+    headers = {}
+    set_page_headers(headers, total, next_cursor)
+    return FastJSONResponse(orders, headers=headers)
+
+@app.get("/orders/{order_id}")
+async def get_order_endpoint(order_id: int, user: dict = Depends(get_current_user), pool: ConnectionPool = Depends(get_db_pool)):
+    order = await pool.read(get_order, order_id)
+    # Someone else's order is reported as missing rather than forbidden.
+    if order is None or (order["buyer_id"] != user["id"] and user["role"] != 'admin'):
+        raise HTTPException(status_code=404, detail="Order not found")
+    return order
+
+@app.post("/purchases/bulk", dependencies=[Depends(require_admin)])
+async def bulk_add_purchases(request: Request, pool: ConnectionPool = Depends(get_db_pool)):
+    return await bulk_ingest(request, pool, Purchase, insert_purchases_chunk)
+
+@app.get("/purchases", response_model=List[PurchaseLine], dependencies=[Depends(require_admin)])
+async def get_purchases(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None,
+                        buyer_id: Optional[int] = None, product_id: Optional[int] = None, payment_status: Optional[str] = None,
+                        since: Optional[str] = None, until: Optional[str] = None, pool: ConnectionPool = Depends(get_db_pool)):
+    purchases, total, next_cursor = await pool.read(paginate, get_all_purchases, count_purchases, limit, decode_purchase_cursor(cursor),
+                                                    cursor_of=lambda purchase: encode_cursor(purchase_key(purchase)), buyer_id=buyer_id, product_id=product_id, payment_status=payment_status,
+                                                    since=since, until=until)
+    headers = {}
+    set_page_headers(headers, total, next_cursor)
+    return FastJSONResponse(purchases, headers=headers)
+
+@app.get("/purchases/export", dependencies=[Depends(require_admin)])
+async def export_purchases(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), buyer_id: Optional[int] = None,
+                           product_id: Optional[int] = None, payment_status: Optional[str] = None,
+                           since: Optional[str] = None, until: Optional[str] = None, pool: ConnectionPool = Depends(get_db_pool)):
+    filters = dict(buyer_id=buyer_id, product_id=product_id, payment_status=payment_status, since=since, until=until)
+    if format == "csv":
+        body, media_type = export_purchases_csv(pool, **filters), "text/csv"
+    else:
+        body, media_type = export_purchases_ndjson(pool, **filters), "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="purchases.{format}"'}
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+@app.get("/sales", dependencies=[Depends(require_admin)])
+async def get_sales_endpoint(group_by: List[str] = Query(["day"]), since: Optional[str] = None, until: Optional[str] = None,
+                             product_id: Optional[int] = None, category: Optional[str] = None, payment_status: Optional[str] = None,
+                             pool: ConnectionPool = Depends(get_db_pool)):
+    unknown = [dimension for dimension in group_by if dimension not in SALES_DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by {unknown}, expected any of {list(SALES_DIMENSIONS)}")
+    return await pool.read(get_sales, list(dict.fromkeys(group_by)), since=since, until=until, product_id=product_id,
+                           category=category, payment_status=payment_status)
+
+@app.get("/users", response_model=List[User], dependencies=[Depends(require_admin)])
+async def get_users(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[int] = None,
+                    role: Optional[str] = None, pool: ConnectionPool = Depends(get_db_pool)):
+    users, total, next_cursor = await pool.read(paginate, get_all_users, count_users, limit, cursor, role=role)
+    headers = {}
+    set_page_headers(headers, total, next_cursor)
+    return FastJSONResponse(users, headers=headers)
+
+@app.get("/users/{user_id}/purchases", response_model=List[UserPurchase])
+async def get_user_purchases_endpoint(user_id: int, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None,
+                                      user: dict = Depends(get_current_user), pool: ConnectionPool = Depends(get_db_pool)):
+    if user_id != user["id"] and user["role"] != 'admin':
+        raise HTTPException(status_code=403, detail="Purchases can only be listed for your own account")
+    purchases, total, next_cursor = await pool.read(paginate, get_user_purchases, count_purchases, limit, decode_purchase_cursor(cursor),
+                                                    cursor_of=lambda purchase: encode_cursor(purchase_key(purchase)), buyer_id=user_id)
+    headers = {}
+    set_page_headers(headers, total, next_cursor)
+    return FastJSONResponse(purchases, headers=headers)
+
+@app.get("/pool_stats")
+async def get_pool_stats(pool: ConnectionPool = Depends(get_db_pool)):
+    return pool.snapshot()
+
+@app.get("/password_stats")
+async def get_password_stats(hasher: PasswordHasher = Depends(get_password_hasher)):
+    return hasher.snapshot()
+
+@app.get("/thumbnail_stats")
+async def get_thumbnail_stats(store: ThumbnailStore = Depends(get_thumbnail_store)):
+    return store.snapshot()
+
+@app.get("/cache_stats")
+async def get_cache_stats():
+    return product_cache.snapshot()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    lines = []
+    for metric in (request_duration, request_count, query_duration, slow_query_count, db_call_duration):
+        lines.extend(metric.render())
+    for prefix, component in (("shopping_mall_db_pool", db_pool), ("shopping_mall_password", password_hasher),
+                              ("shopping_mall_thumbnails", thumbnail_store), ("shopping_mall_product_cache", product_cache)):
+        if component is not None:
+            lines.extend(render_gauges(prefix, component.snapshot()))
+    return PlainTextResponse('\n'.join(lines) + '\n', media_type='text/plain; version=0.0.4')
+
+def main():
+    parser = argparse.ArgumentParser(description="Shopping mall maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="apply pending schema migrations")
+    commands.add_parser("rebuild-sales", help="recompute the sales aggregates from the purchases table")
+    commands.add_parser("fetch-thumbnails", help="download and cache thumbnails for products that have none yet")
+    serve_parser = commands.add_parser("serve", help="run the API in one or more worker processes")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    serve_parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    if args.command == "migrate":
+        print(f"Applied migrations: {migrate_database() or 'none'}")
+    elif args.command == "rebuild-sales":
+        migrate_database()
+        conn = create_connection()
+        try:
+            print(rebuild_sales_aggregates(conn))
+        finally:
+            conn.close()
+    elif args.command == "fetch-thumbnails":
+        migrate_database()
+        print(f"Cached thumbnails: {asyncio.run(fetch_thumbnails())}")
+    elif args.command == "serve":
+        serve(args.host, args.port, args.workers, args.log_level)
+
+async def fetch_thumbnails():
+    pool, store = ConnectionPool(), ThumbnailStore()
+    try:
+        return await cache_missing_thumbnails(pool, store)
+    finally:
+        store.close()
+        pool.close()
+
+def serve(host, port, workers, log_level='info'):
+    import uvicorn
+
+    if workers > 1:
+        if os.environ.get('SHOPPING_MALL_SESSION_BACKEND', 'sqlite') == 'memory':
+            raise SystemExit("The memory session backend cannot be shared by several workers")
+        os.environ['SHOPPING_MALL_SHARED_STATE'] = '1'
+    # Workers are fresh processes that inherit the environment, so this makes
+    # them all sign and verify session tokens with the same key.
+    os.environ.setdefault('SHOPPING_MALL_SECRET_KEY', SECRET_KEY)
+    initialize_database()
+    uvicorn.run("fastapi_app:app", host=host, port=port, workers=workers, log_level=log_level,
+                app_dir=os.path.dirname(os.path.abspath(__file__)))
 
-@app.get("/purchases", response_model=List[Purchase])
-async def get_purchases():
-    conn = create_connection()
-    purchases = get_all_purchases(conn)
-    conn.close()
-    return purchases
-
-@app.get("/users", response_model=List[User])
-async def get_users():
-    conn = create_connection()
-    users = get_all_users(conn)
-    conn.close()
-    return users
+if __name__ == '__main__':
+    main()
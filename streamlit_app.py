@@ -1,6 +1,12 @@
 import streamlit as st
 import requests
-from datetime import datetime
+import uuid
+
+import api_client
+
+PAGE_SIZE = 20
+SEARCH_RESULTS = 50
+THUMBNAIL_WIDTH = 200
 
 def initialize_session_state():
     if 'logged_in' not in st.session_state:
@@ -10,6 +16,49 @@ def initialize_session_state():
     if 'initialized' not in st.session_state:
         st.session_state.initialized = False
 
+def session_token():
+    return (st.session_state.user or {}).get('token')
+
+def show_thumbnail(product):
+    if product.get('thumbnail_hash'):
+        st.image(f"{api_client.API_URL}/thumbnails/{product['thumbnail_hash']}?width={THUMBNAIL_WIDTH}", width=THUMBNAIL_WIDTH)
+    elif product.get('thumbnail_url'):
+        st.image(product['thumbnail_url'], width=THUMBNAIL_WIDTH)
+
+def logout():
+    try:
+        api_client.logout(session_token())
+    except requests.RequestException:
+        pass
+    st.session_state.logged_in = False
+    st.session_state.user = None
+    st.session_state.pop('purchases_export', None)
+
+def fetch_page(path, key, params=None):
+    cursors = st.session_state.setdefault(f'{key}_cursors', [None])
+    page_params = dict(params or {}, limit=PAGE_SIZE)
+    if cursors[-1] is not None:
+        page_params['cursor'] = cursors[-1]
+    body, headers = api_client.get(path, page_params, session_token())
+    next_cursor = headers.get('X-Next-Cursor')
+    st.caption(f"Page {len(cursors)} of {headers.get('X-Total-Count', '?')} total entries")
+    col_prev, col_next = st.columns(2)
+    if len(cursors) > 1 and col_prev.button('Previous', key=f'{key}_prev'):
+        cursors.pop()
+        st.rerun()
+    if next_cursor is not None and col_next.button('Next', key=f'{key}_next'):
+        cursors.append(next_cursor)
+        st.rerun()
+    return body
+
+def find_products(key):
+    query = st.text_input('Search products', key=key)
+    if query.strip():
+        products, _ = api_client.get('/products/search', {"q": query.strip(), "limit": SEARCH_RESULTS})
+    else:
+        products, _ = api_client.get('/products', {"limit": SEARCH_RESULTS})
+    return products
+
 def main():
     if not st.session_state.initialized:  
         st.session_state.initialized = True 
@@ -25,12 +74,12 @@ def main():
             password = st.text_input('Password', type='password')
             if st.button('Login'):
                 try:
-                    response = requests.get('http://localhost:8000/login', params={"username": username, "password": password})
+                    response = api_client.login(username, password)
                     if response.status_code == 200:
                         st.session_state.logged_in = True
                         st.session_state.user = response.json()
                         st.success(f"Welcome back, {st.session_state.user['username']}!")
-                        st.experimental_rerun()
+                        st.rerun()
                     else:
                         st.error("Invalid username or password.")
                 except requests.RequestException as e:
@@ -45,16 +94,9 @@ def main():
             payment_info = st.text_input('Payment Info')
             if st.button('Sign Up'):
                 try:
-                    response = requests.post('http://localhost:8000/register', params={
-                        "username": new_username,
-                        "password": new_password,
-                        "role": "user",
-                        "full_name": full_name,
-                        "address": address,
-                        "payment_info": payment_info
-                    })
+                    response = api_client.register(new_username, new_password, full_name, address, payment_info)
                     if response.status_code == 200:
-                        st.success(response.json()["message"])
+                        st.success("Signed up successfully. You can now log in.")
                     else:
                         st.error("Failed to sign up.")
                 except requests.RequestException as e:
@@ -63,19 +105,16 @@ def main():
     if st.session_state.logged_in and st.session_state.user is not None:
         if st.session_state.user.get("role") == 'admin':
             st.sidebar.subheader('Admin Menu')
-            menu = ['Home', 'Add Product', 'Delete Product', 'All Purchases Log', 'User Information']
+            menu = ['Home', 'Add Product', 'Delete Product', 'All Purchases Log', 'Sales Report', 'User Information']
             choice = st.sidebar.selectbox('Menu', menu)
 
             if choice == 'Home':
                 st.subheader('All Products')
                 try:
-                    response = requests.get('http://localhost:8000/products')
-                    response.raise_for_status()
-                    products = response.json()
+                    products = fetch_page('/products', 'home_products')
                     for product in products:
                         st.write(f"Name: {product['name']}, Category: {product['category']}, Price: ${product['price']}")
-                        if 'thumbnail_url' in product and product['thumbnail_url'] != '':
-                            st.image(product['thumbnail_url'], width=200)
+                        show_thumbnail(product)
                 except requests.RequestException as e:
                     st.error(f"Error fetching products: {e}")
 
@@ -90,12 +129,7 @@ def main():
                 
                     if submit_button:
                         try:
-                            add_product_response = requests.post('http://localhost:8000/add_product', json={
-                                "name": name,
-                                "category": category,
-                                "price": price,
-                                "thumbnail_url": thumbnail_url
-                            })
+                            add_product_response = api_client.add_product(session_token(), name, category, price, thumbnail_url)
                             if add_product_response.status_code == 200:
                                 st.success(add_product_response.json()["message"])
                             else:
@@ -106,18 +140,16 @@ def main():
             elif choice == 'Delete Product':
                 st.subheader('Delete a Product')
                 try:
-                    response = requests.get('http://localhost:8000/products')
-                    response.raise_for_status()
-                    products = response.json()
+                    products = find_products('delete_product_search')
                     product_names = [product['name'] for product in products]
                     
                     selected_product = st.selectbox('Select a product to delete', product_names)
-                    if st.button('Delete'):
+                    if st.button('Delete') and selected_product is not None:
                         try:
-                            delete_response = requests.delete(f"http://localhost:8000/products/{selected_product}")
+                            delete_response = api_client.delete_product(session_token(), selected_product)
                             if delete_response.status_code == 200:
                                 st.success(f"Successfully deleted product: {selected_product}")
-                                st.experimental_rerun()
+                                st.rerun()
                             else:
                                 st.error(f"Failed to delete product: {selected_product}")
                         except requests.RequestException as e:
@@ -128,79 +160,116 @@ def main():
             elif choice == 'All Purchases Log':
                 st.subheader('All Purchases Log')
                 try:
-                    response = requests.get('http://localhost:8000/purchases')
-                    response.raise_for_status()
-                    purchases = response.json()
+                    # The export needs the admin's token, which a plain link cannot send.
+                    export_format = st.radio('Export format', ['csv', 'ndjson'], horizontal=True)
+                    if st.button('Prepare full log export'):
+                        st.session_state.purchases_export = (export_format, api_client.export_purchases(session_token(), export_format))
+                    if st.session_state.get('purchases_export'):
+                        prepared_format, data = st.session_state.purchases_export
+                        st.download_button(f'Download the full log as {prepared_format.upper()}', data, file_name=f'purchases.{prepared_format}',
+                                           mime='text/csv' if prepared_format == 'csv' else 'application/x-ndjson')
+                    purchases = fetch_page('/purchases', 'purchases_log')
                     if purchases:
                         for purchase in purchases:
-                            st.write(f"Buyer ID: {purchase['buyer_id']}, Product ID: {purchase['product_id']}, Purchase Time: {purchase['purchase_time']}, Payment Status: {purchase['payment_status']}, Buyer Address: {purchase['buyer_address']}")
+                            order = f"Order ID: {purchase['order_id']}, " if purchase.get('order_id') else ''
+                            st.write(f"{order}Buyer ID: {purchase['buyer_id']}, Product ID: {purchase['product_id']}, Purchase Time: {purchase['purchase_time']}, Payment Status: {purchase['payment_status']}, Buyer Address: {purchase['buyer_address']}")
                     else:
                         st.write("No purchases found.")
                 except requests.RequestException as e:
                     st.error(f"Error fetching purchases: {e}")
 
+            elif choice == 'Sales Report':
+                st.subheader('Sales Report')
+                group_by = st.multiselect('Group by', ['day', 'hour', 'product', 'category', 'payment_status'], default=['day'])
+                try:
+                    sales, _ = api_client.get('/sales', {"group_by": group_by}, session_token())
+                    st.dataframe(sales)
+                except requests.RequestException as e:
+                    st.error(f"Error fetching sales: {e}")
+
             elif choice == 'User Information':
                 st.subheader('User Information')
                 try:
-                    response = requests.get('http://localhost:8000/users')
-                    response.raise_for_status()
-                    users = response.json()
+                    users = fetch_page('/users', 'user_information')
                     for user in users:
                         st.write(f"Username: {user['username']}, Full Name: {user['full_name']}, Address: {user['address']}, Payment Info: {user['payment_info']}")
                 except requests.RequestException as e:
                     st.error(f"Error fetching users: {e}")
 
             if st.sidebar.button('Logout'):
-                st.session_state.logged_in = False
-                st.session_state.user = None
+                logout()
                 st.success('You have been logged out.')
-                st.experimental_rerun()
+                st.rerun()
 
         else:
             st.sidebar.subheader('User Menu')
-            menu = ['Home', 'Buy Products', 'My Page']
+            menu = ['Home', 'Buy Products', 'My Purchases', 'My Page']
             choice = st.sidebar.selectbox('Menu', menu)
 
             if choice == 'Home':
                 st.subheader('All Products')
                 try:
-                    response = requests.get('http://localhost:8000/products')
-                    response.raise_for_status()
-                    products = response.json()
+                    products = fetch_page('/products', 'home_products')
                     for product in products:
                         st.write(f"Name: {product['name']}, Category: {product['category']}, Price: ${product['price']}")
-                        if 'thumbnail_url' in product and product['thumbnail_url'] != '':
-                            st.image(product['thumbnail_url'], width=200)
+                        show_thumbnail(product)
                 except requests.RequestException as e:
                     st.error(f"Error fetching products: {e}")
 
             elif choice == 'Buy Products':
                 st.subheader('Buy Products')
                 try:
-                    response = requests.get('http://localhost:8000/products')
-                    response.raise_for_status()
-                    products = response.json()
+                    products = find_products('buy_product_search')
                     selected_product = st.selectbox('Select a product', [product['name'] for product in products])
-                    user_address = st.text_input('Home Address')
-                    user_payment_info = st.text_input('Payment Info')
-                    if st.button('Buy'):
-                        try:
-                            purchase_response = requests.post('http://localhost:8000/add_purchase', json={
-                                "buyer_id": st.session_state.user["id"],
-                                "product_id": next(product["id"] for product in products if product["name"] == selected_product),
-                                "purchase_time": datetime.now().isoformat(),
-                                "payment_status": "Completed",
-                                "buyer_address": user_address
-                            })
-                            if purchase_response.status_code == 200:
-                                st.success(f'You have successfully purchased {selected_product}! Address: {user_address}, Payment Info: {user_payment_info}')
-                            else:
-                                st.error("Failed to complete purchase.")
-                        except requests.RequestException as e:
-                            st.error(f"Error connecting to server: {e}")
+                    quantity = st.number_input('Quantity', min_value=1, value=1, step=1)
+                    cart = st.session_state.setdefault('cart', {})
+                    if st.button('Add to Cart') and selected_product is not None:
+                        product = next(product for product in products if product["name"] == selected_product)
+                        entry = cart.setdefault(product["id"], {"name": product["name"], "price": product["price"], "quantity": 0})
+                        entry["quantity"] += int(quantity)
+                        st.session_state.pop('checkout_key', None)
+                    if cart:
+                        st.write('Cart:')
+                        for item in cart.values():
+                            st.write(f"{item['name']} x {item['quantity']} (${item['price']} each)")
+                        st.write(f"Estimated total: ${sum(item['price'] * item['quantity'] for item in cart.values()):.2f}")
+                        user_address = st.text_input('Home Address')
+                        user_payment_info = st.text_input('Payment Info')
+                        col_checkout, col_clear = st.columns(2)
+                        if col_clear.button('Clear Cart'):
+                            cart.clear()
+                            st.session_state.pop('checkout_key', None)
+                            st.rerun()
+                        if col_checkout.button('Checkout'):
+                            # One key per cart, so retrying a checkout that timed out cannot place the order twice.
+                            checkout_key = st.session_state.setdefault('checkout_key', uuid.uuid4().hex)
+                            try:
+                                items = [{"product_id": product_id, "quantity": item["quantity"]} for product_id, item in cart.items()]
+                                checkout_response = api_client.checkout(session_token(), items, user_address, checkout_key)
+                                if checkout_response.status_code == 200:
+                                    order = checkout_response.json()
+                                    st.success(f"Order #{order['id']} placed! Total: ${order['total']}, Address: {user_address}, Payment Info: {user_payment_info}")
+                                    cart.clear()
+                                    st.session_state.pop('checkout_key', None)
+                                else:
+                                    st.error(f"Failed to complete purchase: {checkout_response.json().get('detail')}")
+                            except requests.RequestException as e:
+                                st.error(f"Error connecting to server: {e}")
                 except requests.RequestException as e:
                     st.error(f"Error fetching products: {e}")
 
+            elif choice == 'My Purchases':
+                st.subheader('My Purchases')
+                try:
+                    purchases = fetch_page(f'/users/{st.session_state.user["id"]}/purchases', 'my_purchases')
+                    if purchases:
+                        for purchase in purchases:
+                            st.write(f"{purchase['purchase_time']}: {purchase['product_name']} x {purchase['quantity']} at ${purchase['unit_price']}, Payment Status: {purchase['payment_status']}")
+                    else:
+                        st.write("No purchases found.")
+                except requests.RequestException as e:
+                    st.error(f"Error fetching purchases: {e}")
+
             elif choice == 'My Page':
                 st.subheader('My Page')
                 st.write(f'Username: {st.session_state.user["username"]}')
@@ -209,7 +278,6 @@ def main():
                 st.write(f'Payment Info: {st.session_state.user["payment_info"]}')
                 
                 with st.form(key='edit_user_info_form'):
-                    new_username = st.text_input('New Username', value=st.session_state.user["username"])
                     new_full_name = st.text_input('Full Name', value=st.session_state.user["full_name"])
                     new_address = st.text_input('Address', value=st.session_state.user["address"])
                     new_payment_info = st.text_input('Payment Info', value=st.session_state.user["payment_info"])
@@ -217,28 +285,22 @@ def main():
 
                     if submit_button:
                         try:
-                            response = requests.post('http://localhost:8000/update_user_info', params={
-                                "username": new_username,
-                                "full_name": new_full_name,
-                                "address": new_address,
-                                "payment_info": new_payment_info
-                            })
+                            response = api_client.update_user_info(session_token(), new_full_name, new_address, new_payment_info)
                             if response.status_code == 200:
                                 st.success('User information updated successfully!')
-                                st.session_state.user["username"] = new_username
                                 st.session_state.user["full_name"] = new_full_name
                                 st.session_state.user["address"] = new_address
                                 st.session_state.user["payment_info"] = new_payment_info
-                                st.experimental_rerun()
+                                st.rerun()
                             else:
                                 st.error("Failed to update user information.")
                         except requests.RequestException as e:
                             st.error(f"Error connecting to server: {e}")
 
             if st.sidebar.button('Logout'):
-                st.session_state.logged_in = False
+                logout()
                 st.success('You have been logged out.')
-                st.experimental_rerun()
+                st.rerun()
 
 initialize_session_state()
 
@@ -0,0 +1,50 @@
+import os
+import sqlite3
+
+# Read when fastapi_app is imported, so it is set before any test module
+# imports it; the password hasher's worker processes inherit it too.
+os.environ.setdefault('SHOPPING_MALL_BCRYPT_ROUNDS', '4')
+
+import pytest
+from fastapi.testclient import TestClient
+
+import fastapi_app
+
+@pytest.fixture
+def db(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'shopping_mall.db'))
+    fastapi_app.run_migrations(conn)
+    yield conn
+    conn.close()
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # A fresh database, thumbnail directory, catalog cache and session store
+    # for every test; the app seeds the admin/admin account on startup.
+    path = str(tmp_path / 'shopping_mall.db')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('SHOPPING_MALL_DB', path)
+    monkeypatch.setattr(fastapi_app, 'DATABASE', path)
+    monkeypatch.setattr(fastapi_app, 'product_cache', fastapi_app.ProductCache())
+    monkeypatch.setattr(fastapi_app, 'session_store', fastapi_app.create_session_store('memory'))
+    with TestClient(fastapi_app.app) as client:
+        yield client
+
+def login(client, username='admin', password='admin'):
+    response = client.get('/login', params={"username": username, "password": password})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['token']}"}
+
+def register(client, username, password='secret'):
+    response = client.post('/register', params={"password": password}, json={
+        "username": username, "role": "user", "full_name": username.title(), "address": "1 Main St", "payment_info": "card"})
+    assert response.status_code == 200, response.text
+    return login(client, username, password), response.json()["id"]
+
+def add_product(client, admin, name, price=10.0, stock=None):
+    params = {"name": name, "category": "test", "price": price, "thumbnail_url": ""}
+    if stock is not None:
+        params["stock"] = stock
+    assert client.post('/add_product', params=params, headers=admin).status_code == 200
+    products = client.get('/products', params={"limit": 1000}).json()
+    return next(product["id"] for product in products if product["name"] == name)
@@ -0,0 +1,45 @@
+import pytest
+
+from conftest import add_product, login, register
+
+def test_forged_and_tampered_tokens_are_rejected(client):
+    buyer, _ = register(client, 'buyer')
+    session_id, _, signature = buyer["Authorization"].split()[1].partition('.')
+    tampered = signature[:-1] + ('0' if signature[-1] != '0' else '1')
+    for token in (f'{session_id}.{tampered}', f'{session_id}x.{signature}', session_id, 'forged.token'):
+        response = client.get('/me', headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 401
+        assert response.headers["WWW-Authenticate"] == 'Bearer'
+    assert client.get('/me').status_code == 401
+    assert client.get('/me', headers=buyer).json()["username"] == 'buyer'
+
+@pytest.mark.parametrize("method,path,params", [
+    ('GET', '/users', {}),
+    ('GET', '/purchases', {}),
+    ('GET', '/purchases/export', {}),
+    ('GET', '/sales', {}),
+    ('POST', '/add_product', {"name": "mug", "category": "cups", "price": 1, "thumbnail_url": ""}),
+    ('DELETE', '/products/mug', {}),
+])
+def test_admin_endpoints_reject_other_users(client, method, path, params):
+    buyer, _ = register(client, 'buyer')
+    assert client.request(method, path, params=params, headers=buyer).status_code == 403
+    assert client.request(method, path, params=params).status_code == 401
+
+def test_users_cannot_purchase_for_someone_else(client):
+    admin = login(client)
+    buyer, buyer_id = register(client, 'buyer')
+    _, other_id = register(client, 'other')
+    product_id = add_product(client, admin, 'mug')
+    purchase = {"product_id": product_id, "purchase_time": "", "payment_status": "Completed", "buyer_address": "1 Main St"}
+    assert client.post('/add_purchase', json={**purchase, "buyer_id": other_id}, headers=buyer).status_code == 403
+    assert client.post('/add_purchase', json={**purchase, "buyer_id": buyer_id}, headers=buyer).status_code == 200
+    assert client.post('/add_purchase', json={**purchase, "buyer_id": other_id}, headers=admin).status_code == 200
+
+def test_logout_revokes_the_token(client):
+    buyer, _ = register(client, 'buyer')
+    other_session = login(client, 'buyer', 'secret')
+    assert client.post('/logout', headers=buyer).status_code == 200
+    assert client.get('/me', headers=buyer).status_code == 401
+    assert client.post('/logout', headers=buyer).status_code == 401
+    assert client.get('/me', headers=other_session).status_code == 200
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import fastapi_app
+
+class StreamedRequest:
+    def __init__(self, content_type, body, chunk_size=3):
+        self.headers = {"content-type": content_type}
+        self._chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+    async def stream(self):
+        for chunk in self._chunks:
+            yield chunk
+
+def bulk_rows(content_type, body, model=fastapi_app.Product):
+    async def collect():
+        return [row async for row in fastapi_app.iter_bulk_rows(StreamedRequest(content_type, body), model)]
+    return asyncio.run(collect())
+
+def test_csv_keeps_quoted_newlines_and_multibyte_text():
+    body = 'name,category,price\r\n"Mug, ""large""\nblue",cups,3.5\r\nCafé,cups,2\n'.encode()
+    assert bulk_rows('text/csv', body) == [
+        (0, {"name": 'Mug, "large"\nblue', "category": 'cups', "price": '3.5'}),
+        (1, {"name": 'Café', "category": 'cups', "price": '2'}),
+    ]
+
+def test_csv_empty_cells_leave_optional_fields_unset():
+    body = b'name,category,price,stock,thumbnail_url\nMug,,3.5,,\n'
+    (_, row), = bulk_rows('text/csv', body)
+    assert row == {"name": 'Mug', "category": '', "price": '3.5', "stock": None, "thumbnail_url": None}
+    assert fastapi_app.Product(**row).stock is None
+
+def test_invalid_utf8_is_a_row_error():
+    rows = bulk_rows('text/csv', b'name,category,price\nbad\xff,x,1\ngood,x,1\n')
+    assert isinstance(rows[0][1], ValueError)
+    assert rows[1] == (1, {"name": 'good', "category": 'x', "price": '1'})
+    rows = bulk_rows('application/x-ndjson', b'{"name": "bad\xff"}\n{"name": "good"}\n')
+    assert isinstance(rows[0][1], ValueError)
+    assert rows[1] == (1, {"name": 'good'})
+
+def test_invalid_utf8_header_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        bulk_rows('text/csv', b'name\xff,category\nMug,cups\n')
+    assert error.value.status_code == 400
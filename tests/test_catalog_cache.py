@@ -0,0 +1,25 @@
+from conftest import add_product, login
+
+def test_matching_etag_gets_304(client):
+    add_product(client, login(client), 'mug')
+    first = client.get('/products')
+    etag = first.headers["ETag"]
+    response = client.get('/products', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers["ETag"] == etag
+    assert client.get('/products', headers={"If-None-Match": '"stale"'}).status_code == 200
+
+def test_etag_changes_after_a_catalog_write(client):
+    admin = login(client)
+    add_product(client, admin, 'mug')
+    etag = client.get('/products').headers["ETag"]
+    add_product(client, admin, 'cup')
+    response = client.get('/products', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [product["name"] for product in response.json()] == ['mug', 'cup']
+
+def test_etag_depends_on_the_query(client):
+    add_product(client, login(client), 'mug')
+    assert client.get('/products').headers["ETag"] != client.get('/products', params={"category": "test"}).headers["ETag"]
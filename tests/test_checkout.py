@@ -0,0 +1,50 @@
+from conftest import add_product, login, register
+
+def checkout(client, headers, items, key=None):
+    return client.post('/checkout', headers={**headers, **({"Idempotency-Key": key} if key else {})},
+                       json={"items": items, "buyer_address": "1 Main St"})
+
+def test_replayed_idempotency_key_returns_the_original_order(client):
+    admin = login(client)
+    buyer, _ = register(client, 'buyer')
+    product_id = add_product(client, admin, 'mug', stock=5)
+    items = [{"product_id": product_id, "quantity": 2}]
+    first = checkout(client, buyer, items, 'order-1')
+    assert first.status_code == 200
+    assert 'Idempotent-Replayed' not in first.headers
+    replay = checkout(client, buyer, items, 'order-1')
+    assert replay.status_code == 200
+    assert replay.headers["Idempotent-Replayed"] == 'true'
+    assert replay.json() == first.json()
+    assert client.get(f'/products/{product_id}/stock').json()["stock"] == 3
+    assert len(client.get('/orders', headers=buyer).json()) == 1
+
+def test_reused_idempotency_key_for_another_basket_is_409(client):
+    admin = login(client)
+    buyer, _ = register(client, 'buyer')
+    product_id = add_product(client, admin, 'mug', stock=5)
+    assert checkout(client, buyer, [{"product_id": product_id, "quantity": 1}], 'order-1').status_code == 200
+    assert checkout(client, buyer, [{"product_id": product_id, "quantity": 2}], 'order-1').status_code == 409
+    assert client.get(f'/products/{product_id}/stock').json()["stock"] == 4
+
+def test_basket_with_a_missing_product_rolls_back(client):
+    admin = login(client)
+    buyer, _ = register(client, 'buyer')
+    product_id = add_product(client, admin, 'mug', stock=5)
+    response = checkout(client, buyer, [{"product_id": product_id, "quantity": 1}, {"product_id": 999, "quantity": 1}], 'order-1')
+    assert response.status_code == 404
+    assert client.get(f'/products/{product_id}/stock').json()["stock"] == 5
+    assert client.get('/orders', headers=buyer).json() == []
+    assert client.get('/sales', params={"group_by": "product"}, headers=admin).json() == []
+    # The key was not used up by the failed attempt.
+    assert checkout(client, buyer, [{"product_id": product_id, "quantity": 1}], 'order-1').status_code == 200
+
+def test_short_stock_sells_nothing(client):
+    admin = login(client)
+    buyer, _ = register(client, 'buyer')
+    mug = add_product(client, admin, 'mug', stock=5)
+    cup = add_product(client, admin, 'cup', stock=1)
+    response = checkout(client, buyer, [{"product_id": mug, "quantity": 1}, {"product_id": cup, "quantity": 2}])
+    assert response.status_code == 409
+    assert client.get(f'/products/{mug}/stock').json()["stock"] == 5
+    assert client.get(f'/products/{cup}/stock').json()["stock"] == 1
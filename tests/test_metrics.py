@@ -0,0 +1,24 @@
+import sqlite3
+
+import fastapi_app
+
+def statement_labels(path, monkeypatch, helper, *args, **kwargs):
+    labels = []
+    monkeypatch.setattr(fastapi_app, 'observe_query', lambda sql, started: labels.append(fastapi_app.normalize_sql(sql)))
+    conn = sqlite3.connect(path, factory=fastapi_app.InstrumentedConnection)
+    try:
+        helper(conn, *args, **kwargs)
+    finally:
+        conn.close()
+    return labels
+
+def test_normalize_sql_collapses_literals_and_in_lists():
+    assert (fastapi_app.normalize_sql("SELECT * FROM t WHERE a = 'x' AND b IN (1, 2,\n 3) AND c > 2.5")
+            == 'SELECT * FROM t WHERE a = ? AND b IN (?) AND c > ?')
+
+def test_purchase_log_filters_get_their_own_labels(db, tmp_path, monkeypatch):
+    path = str(tmp_path / 'shopping_mall.db')
+    pages = [{}, {"buyer_id": 2}, {"since": '2024-01-01', "until": '2024-02-01'}, {"after_id": ['2024-01-05', 0, 1, 1]}]
+    labels = [statement_labels(path, monkeypatch, fastapi_app.get_all_purchases, limit=10, **filters)[0] for filters in pages]
+    assert len(set(labels)) == len(pages)
+    assert all('ORDER BY' in label for label in labels)
@@ -0,0 +1,33 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import fastapi_app
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(fastapi_app, 'DATABASE', str(tmp_path / 'pool.db'))
+    pool = fastapi_app.ConnectionPool(readers=1, timeout=0.5)
+    yield pool
+    pool.close()
+
+def sleep_query(conn, seconds):
+    time.sleep(seconds)
+    return conn.execute('SELECT 1').fetchone()[0]
+
+async def gather_reads(pool, count, seconds):
+    return await asyncio.gather(*(pool.read(sleep_query, seconds) for _ in range(count)), return_exceptions=True)
+
+def test_queued_calls_report_their_wait(pool):
+    assert asyncio.run(gather_reads(pool, 3, 0.05)) == [1, 1, 1]
+    stats = pool.snapshot()
+    assert stats["reader_acquired"] == 3
+    assert stats["reader_max_wait_seconds"] >= 0.09
+
+def test_queued_calls_time_out(pool):
+    results = asyncio.run(gather_reads(pool, 3, 0.3))
+    assert results[:2] == [1, 1]
+    assert isinstance(results[2], HTTPException) and results[2].status_code == 503
+    assert pool.snapshot()["timeouts"] == 1
@@ -0,0 +1,30 @@
+from conftest import add_product, login, register
+
+def purchase(client, headers, buyer_id, product_id, quantity=1):
+    return client.post('/add_purchase', headers=headers, json={
+        "buyer_id": buyer_id, "product_id": product_id, "purchase_time": "", "payment_status": "Completed",
+        "buyer_address": "1 Main St", "quantity": quantity})
+
+def test_add_purchase_cannot_oversell(client):
+    admin = login(client)
+    buyer, buyer_id = register(client, 'buyer')
+    product_id = add_product(client, admin, 'mug', stock=2)
+    assert purchase(client, buyer, buyer_id, product_id).status_code == 200
+    assert purchase(client, buyer, buyer_id, product_id).status_code == 200
+    response = purchase(client, buyer, buyer_id, product_id)
+    assert response.status_code == 409
+    assert client.get(f'/products/{product_id}/stock').json()["stock"] == 0
+    sales = client.get('/sales', params={"group_by": "product", "product_id": product_id}, headers=admin).json()
+    assert sum(row["purchases"] for row in sales) == 2
+
+def test_add_purchase_takes_stock_in_quantities(client):
+    admin = login(client)
+    buyer, buyer_id = register(client, 'buyer')
+    product_id = add_product(client, admin, 'mug', stock=3)
+    assert purchase(client, buyer, buyer_id, product_id, quantity=4).status_code == 409
+    assert purchase(client, buyer, buyer_id, product_id, quantity=3).status_code == 200
+    assert client.get(f'/products/{product_id}/stock').json()["stock"] == 0
+
+def test_add_purchase_of_unknown_product_is_404(client):
+    buyer, buyer_id = register(client, 'buyer')
+    assert purchase(client, buyer, buyer_id, 999).status_code == 404
@@ -0,0 +1,98 @@
+import sqlite3
+
+import pytest
+
+import fastapi_app
+
+# The index each source of the purchase log is read through. Order lines of
+# one product are the exception that gets sorted: order_items has no time
+# column, and sorting one product's lines beats walking every order.
+PURCHASE_FILTERS = [
+    ({}, [('idx_purchases_purchase_time', False), ('idx_orders_created_at', False)]),
+    ({"buyer_id": 2}, [('idx_purchases_buyer_history', False), ('idx_orders_buyer_history', False)]),
+    ({"product_id": 1}, [('idx_purchases_product_time', False), ('idx_order_items_product_id', True)]),
+    ({"since": '2024-01-01', "until": '2024-02-01'}, [('idx_purchases_purchase_time', False), ('idx_orders_created_at', False)]),
+]
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'plans.db'))
+    fastapi_app.run_migrations(conn)
+    conn.execute("INSERT INTO users (username, role) VALUES ('admin', 'admin'), ('buyer', 'user')")
+    conn.execute("INSERT INTO products (name, category, price) VALUES ('a', 'x', 1), ('b', 'y', 2)")
+    conn.execute("INSERT INTO purchases (buyer_id, product_id, purchase_time, payment_status, quantity, unit_price) "
+                 "VALUES (2, 1, '2024-01-05', 'Completed', 1, 1)")
+    conn.execute("INSERT INTO orders (buyer_id, created_at, payment_status, total) VALUES (2, '2024-01-06', 'Completed', 2)")
+    conn.execute('INSERT INTO order_items (order_id, product_id, quantity, unit_price) VALUES (1, 2, 1, 2)')
+    conn.commit()
+    yield conn
+    conn.close()
+
+def query_plans(conn, helper, *args, **kwargs):
+    # Runs the helper, then explains every SELECT it issued with the
+    # parameters it bound. Each plan is a list of (id, parent, detail).
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        helper(conn, *args, **kwargs)
+    finally:
+        conn.set_trace_callback(None)
+    return [[(row[0], row[1], row[3]) for row in conn.execute('EXPLAIN QUERY PLAN ' + statement)]
+            for statement in statements if statement.lstrip().upper().startswith('SELECT')]
+
+def subtree(plan, root):
+    ids = {root}
+    for node, parent, _ in plan:
+        if parent in ids:
+            ids.add(node)
+    return [detail for node, _, detail in plan if node in ids and node != root]
+
+def source_plans(plan):
+    # The plan of each branch of a merged purchase listing, without the
+    # final merge, which sorts at most limit rows per branch.
+    return [subtree(plan, node) for node, _, detail in plan if detail.startswith('CO-ROUTINE')]
+
+def assert_indexed(details, index, sorts=False):
+    assert any(detail.startswith('SEARCH') and f'INDEX {index} ' in detail for detail in details), details
+    assert any('TEMP B-TREE' in detail for detail in details) == sorts, details
+    assert not any(detail.startswith('SCAN') for detail in details), details
+
+def test_migrations_are_recorded(conn):
+    assert fastapi_app.get_schema_version(conn) == fastapi_app.MIGRATIONS[-1][0]
+    assert fastapi_app.run_migrations(conn) == []
+
+@pytest.mark.parametrize("filters,indexes", PURCHASE_FILTERS)
+def test_purchase_log_pages_read_each_source_in_key_order(conn, filters, indexes):
+    select = query_plans(conn, fastapi_app.paginate, fastapi_app.get_all_purchases, fastapi_app.count_purchases, 100,
+                         ['2024-01-05', 0, 1, 1], cursor_of=fastapi_app.purchase_key, **filters)[0]
+    branches = source_plans(select)
+    assert len(branches) == len(indexes)
+    for details, (index, sorts) in zip(branches, indexes):
+        assert_indexed(details, index, sorts)
+
+def test_user_purchase_history_uses_covering_indexes(conn):
+    plans = query_plans(conn, fastapi_app.get_user_purchases, 100, ['2024-02-01', 1, 9, 9], buyer_id=2)
+    purchases, orders = source_plans(plans[0])
+    assert_indexed(purchases, 'idx_purchases_buyer_history')
+    assert any('COVERING INDEX idx_purchases_buyer_history' in detail for detail in purchases)
+    assert_indexed(orders, 'idx_orders_buyer_history')
+    assert any('COVERING INDEX idx_orders_buyer_history' in detail for detail in orders)
+
+def test_purchase_counts_use_an_index(conn):
+    for filters, _ in PURCHASE_FILTERS[1:]:
+        for plan in query_plans(conn, fastapi_app.count_purchases, **filters):
+            assert not any('TEMP B-TREE' in detail for _, _, detail in plan)
+            assert any('INDEX' in detail for _, _, detail in plan if detail.startswith('SEARCH o') or detail.startswith('SEARCH pu')), plan
+
+def test_category_listing_uses_category_index(conn):
+    select, count = query_plans(conn, fastapi_app.paginate, fastapi_app.get_all_products, fastapi_app.count_products, 100, 1, category='x')
+    assert_indexed([detail for _, _, detail in select], 'idx_products_category')
+    assert_indexed([detail for _, _, detail in count], 'idx_products_category')
+
+def test_buyer_orders_page_by_id_without_sorting(conn):
+    select = query_plans(conn, fastapi_app.paginate, fastapi_app.get_all_orders, fastapi_app.count_orders, 100, 0, buyer_id=2)[0]
+    assert_indexed([detail for _, _, detail in select], 'idx_orders_buyer_id')
+
+def test_login_looks_up_username_by_index(conn):
+    plan, = query_plans(conn, fastapi_app.get_login_user, 'buyer')
+    assert any(detail.startswith('SEARCH users USING INDEX') for _, _, detail in plan), plan
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import fastapi_app
+
+BUYER = 1
+OTHER_BUYER = 2
+
+@pytest.fixture
+def conn(db):
+    db.execute("INSERT INTO users (username, role) VALUES ('buyer', 'user'), ('other', 'user')")
+    db.execute("INSERT INTO products (name, category, price, stock) VALUES ('mug', 'cups', 5, 5), ('cup', 'cups', 2, NULL)")
+    db.commit()
+    return db
+
+def stock(conn, product_id=1):
+    return conn.execute('SELECT stock FROM products WHERE id = ?', (product_id,)).fetchone()[0]
+
+def reserve(conn, quantity, buyer_id=BUYER, ttl=fastapi_app.RESERVATION_TTL):
+    reservation = fastapi_app.Reservation(items=[{"product_id": 1, "quantity": quantity}])
+    return fastapi_app.reserve(conn, buyer_id, reservation, ttl)["id"]
+
+def checkout(conn, quantity, reservation_id=None):
+    order = fastapi_app.Order(items=[{"product_id": 1, "quantity": quantity}], buyer_address='1 Main St', reservation_id=reservation_id)
+    return fastapi_app.checkout(conn, BUYER, order)[0]
+
+def reservation_count(conn):
+    return conn.execute('SELECT COUNT(*) FROM reservations').fetchone()[0]
+
+@pytest.mark.parametrize("reserved,bought,left", [(3, 3, 2), (3, 5, 0), (3, 1, 4)])
+def test_checkout_settles_the_reservation(conn, reserved, bought, left):
+    reservation_id = reserve(conn, reserved)
+    assert stock(conn) == 5 - reserved
+    assert checkout(conn, bought, reservation_id)["items"][0]["quantity"] == bought
+    assert stock(conn) == left
+    assert reservation_count(conn) == 0
+
+def test_checkout_beyond_the_reservation_rolls_back(conn):
+    reservation_id = reserve(conn, 3)
+    with pytest.raises(HTTPException) as error:
+        checkout(conn, 6, reservation_id)
+    assert error.value.status_code == 409
+    assert stock(conn) == 2
+    assert reservation_count(conn) == 1
+
+def test_reserving_more_than_stock_is_409(conn):
+    with pytest.raises(HTTPException) as error:
+        reserve(conn, 6)
+    assert error.value.status_code == 409
+    assert stock(conn) == 5
+    assert reservation_count(conn) == 0
+
+def test_expire_reservations_returns_stock(conn):
+    reserve(conn, 2, ttl=-1)
+    reserve(conn, 1)
+    assert stock(conn) == 2
+    assert fastapi_app.expire_reservations(conn) == 1
+    assert stock(conn) == 4
+    assert reservation_count(conn) == 1
+    later = (datetime.now() + timedelta(seconds=fastapi_app.RESERVATION_TTL + 1)).isoformat()
+    assert fastapi_app.expire_reservations(conn, later) == 1
+    assert stock(conn) == 5
+    assert conn.execute('SELECT COUNT(*) FROM reservation_items').fetchone()[0] == 0
+
+def test_expired_reservation_cannot_be_checked_out(conn):
+    reservation_id = reserve(conn, 2, ttl=-1)
+    with pytest.raises(HTTPException) as error:
+        checkout(conn, 2, reservation_id)
+    assert error.value.status_code == 404
+    assert stock(conn) == 3
+
+def test_cancel_reservation_returns_stock_once(conn):
+    reservation_id = reserve(conn, 3)
+    with pytest.raises(HTTPException) as error:
+        fastapi_app.cancel_reservation(conn, OTHER_BUYER, reservation_id)
+    assert error.value.status_code == 404
+    assert stock(conn) == 2
+    fastapi_app.cancel_reservation(conn, BUYER, reservation_id)
+    assert stock(conn) == 5
+    with pytest.raises(HTTPException):
+        fastapi_app.cancel_reservation(conn, BUYER, reservation_id)
+    assert stock(conn) == 5
+
+def test_unlimited_stock_stays_unlimited(conn):
+    reservation = fastapi_app.Reservation(items=[{"product_id": 2, "quantity": 100}])
+    reservation_id = fastapi_app.reserve(conn, BUYER, reservation)["id"]
+    fastapi_app.cancel_reservation(conn, BUYER, reservation_id)
+    assert stock(conn, 2) is None
@@ -0,0 +1,41 @@
+import asyncio
+import base64
+import io
+import os
+
+import pytest
+
+import fastapi_app
+
+Image = pytest.importorskip('PIL.Image')
+
+@pytest.fixture
+def store(tmp_path):
+    store = fastapi_app.ThumbnailStore(directory=str(tmp_path), quota_bytes=10 ** 9, workers=1)
+    yield store
+    store.close()
+
+@pytest.fixture
+def url():
+    output = io.BytesIO()
+    Image.new('RGB', (800, 600), 'red').save(output, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(output.getvalue()).decode()
+
+def test_ingest_rewrites_evicted_variants(store, url):
+    digest = store.ingest(url)
+    os.remove(store.path(digest, 200))
+    assert store.ingest(url) == digest
+    path, media_type = store.open(digest, 200)
+    assert media_type == 'image/png'
+    with Image.open(path) as image:
+        assert image.width == 200
+
+def test_restore_rebuilds_a_variant_from_the_original(store, url):
+    digest = store.ingest(url)
+    os.remove(store.path(digest, 400))
+    assert asyncio.run(store.restore(digest, 400))
+    assert store.open(digest, 400)[0] is not None
+    os.remove(store.path(digest))
+    os.remove(store.path(digest, 400))
+    assert not asyncio.run(store.restore(digest, 400))
+    assert store.open(digest, 400) == (None, None)